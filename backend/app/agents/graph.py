@@ -1,16 +1,62 @@
 
+import asyncio
+import logging
+import time
 from langgraph.graph import END, StateGraph
 from app.agents.nodes.router import route_question
 from app.agents.nodes.grader import grade_documents
 from app.agents.nodes.generate import generate, generate_casual
 from app.agents.state import GraphState
-import chromadb
 from app.core.config import settings
-from app.core.chroma import get_collection
+from app.core.log import get_logger, log_event
+from app.core.metrics import SPECULATION_SAVED_SECONDS, SPECULATIVE_RETRIEVALS, instrument_node
+from app.core.retrieval import hybrid_search
 
-from app.core.chroma import get_chroma_client
+logger = get_logger("graph")
 
-def retrieve(state):
+async def prefetch_documents(question: str, filenames=None):
+    """Retrieval started before routing finishes. Returns (hybrid_search result, seconds taken)."""
+    started = time.perf_counter()
+    result = await hybrid_search(question, filenames)
+    return result, time.perf_counter() - started
+
+def discard_prefetch(prefetch: asyncio.Task):
+    """
+    Cancels a speculative retrieval nobody will await. One that already
+    failed has its exception retrieved, so asyncio doesn't warn about it.
+    """
+    prefetch.cancel()
+    prefetch.add_done_callback(lambda task: None if task.cancelled() else task.exception())
+
+async def route(state):
+    """
+    Decides between retrieval and casual chat. With SPECULATIVE_RETRIEVAL,
+    retrieval starts at the same time and is handed to `retrieve` if the
+    router picks it, or cancelled otherwise.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): route, plus prefetch when a speculative retrieval is kept
+    """
+    if not settings.SPECULATIVE_RETRIEVAL:
+        return {"route": await asyncio.to_thread(route_question, state)}
+    
+    prefetch = asyncio.create_task(prefetch_documents(state["question"], state.get("filenames")))
+    try:
+        decision = await asyncio.to_thread(route_question, state)
+    except BaseException:
+        discard_prefetch(prefetch)
+        raise
+    
+    if decision == "retrieve":
+        return {"route": decision, "prefetch": prefetch}
+    discard_prefetch(prefetch)
+    SPECULATIVE_RETRIEVALS.labels(outcome="discarded").inc()
+    return {"route": decision}
+
+async def retrieve(state):
     """
     Retrieve documents
 
@@ -18,66 +64,48 @@ def retrieve(state):
         state (dict): The current graph state
 
     Returns:
-        state (dict): New key added to state, documents, that contains retrieved documents
+        state (dict): New keys documents, the retrieved documents, and scores,
+        their cosine similarity to the question by chunk id
     """
-    print("---RETRIEVE---")
     question = state["question"]
 
-    # Retrieval
+    # Retrieval, unless it was already started alongside routing
+    prefetch = state.get("prefetch")
     try:
-        from langchain_chroma import Chroma
-        from langchain_community.embeddings import OllamaEmbeddings
-        
-        # Use singleton client
-        client = get_chroma_client()
-        
-        emb_model = OllamaEmbeddings(base_url=settings.OLLAMA_BASE_URL, model=settings.EMBEDDING_MODEL)
-        
-        print(f"DEBUG: Using Chroma collection: {settings.CHROMA_COLLECTION_NAME}")
-        vectorstore = Chroma(
-            client=client,
-            collection_name=settings.CHROMA_COLLECTION_NAME,
-            embedding_function=emb_model,
+        if prefetch is not None:
+            waited = time.perf_counter()
+            (documents, scores), seconds = await prefetch
+            waited = time.perf_counter() - waited
+            SPECULATIVE_RETRIEVALS.labels(outcome="used").inc()
+            SPECULATION_SAVED_SECONDS.observe(max(0.0, seconds - waited))
+        else:
+            documents, scores = await hybrid_search(question, state.get("filenames"))
+        log_event(
+            logger, "retrieved", collection=settings.CHROMA_COLLECTION_NAME, documents=len(documents),
+            scoped=state.get("filenames") is not None,
         )
         
-        retriever = vectorstore.as_retriever()
-        print(f"DEBUG: Invoking retriever with question: {question}")
-        documents = retriever.invoke(question)
-        print(f"DEBUG: Retrieved {len(documents)} documents")
-        
-        return {"documents": documents, "question": question}
+        return {"documents": documents, "scores": scores, "question": question}
     except Exception as e:
-        print(f"ERROR in retrieve: {e}")
-        import traceback
-        traceback.print_exc()
+        log_event(logger, "retrieve_failed", logging.ERROR, exc_info=e)
         raise e
 
 def build_graph():
     workflow = StateGraph(GraphState)
 
-    # Define the nodes
-    # Remove orphaned router node definition
-    # workflow.add_node("router", route_question)
-    # Wait, route_question is a conditional edge logic, OR a node that returns the route. 
-    # The prompt said "Node: Router ... Returns a JSON action". 
-    # In LangGraph, usually we have a START node leading to a conditional edge or a specific node.
-    # Let's make "router" a node that just passes state but we use its logic in the conditional edge 
-    # OR we use `route_question` function AS the conditional edge logic from START.
-    # The prompt says "Node: Router". So let's add it as a node if it modifies state or does work.
-    # But `route_question` implementation I wrote returns a string "retrieve" or "generate_casual". 
-    # That fits a conditional edge function.
-    
-    # Let's follow the standard pattern:
-    # START -> conditional_edge(route_question) -> "retrieve" or "generate_casual"
-    
-    workflow.add_node("retrieve", retrieve)
-    workflow.add_node("grade_documents", grade_documents)
-    workflow.add_node("generate", generate)
-    workflow.add_node("generate_casual", generate_casual)
+    # route_question puts its decision in state; a conditional edge on state["route"] picks the next node
+    # Each node is timed into nurag_graph_node_seconds
+    workflow.add_node("route_question", instrument_node("route_question", route))
+    workflow.add_node("retrieve", instrument_node("retrieve", retrieve))
+    workflow.add_node("grade_documents", instrument_node("grade_documents", grade_documents))
+    workflow.add_node("generate", instrument_node("generate", generate))
+    workflow.add_node("generate_casual", instrument_node("generate_casual", generate_casual))
 
     # Build the graph
-    workflow.set_conditional_entry_point(
-        route_question,
+    workflow.set_entry_point("route_question")
+    workflow.add_conditional_edges(
+        "route_question",
+        lambda state: state["route"],
         {
             "retrieve": "retrieve",
             "generate_casual": "generate_casual",
@@ -1,50 +1,66 @@
 from app.core.config import settings
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_community.chat_models import ChatOllama
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
-from app.db.db import get_db_connection
+from app.core.agent_registry import agent_registry
+from app.core.context import pack_context
+from app.core.log import get_logger, log_event
+from app.core.memory import history_messages
+from app.core.ollama import get_chat_model
 
-def get_active_agent_prompt():
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT system_prompt, model FROM agents WHERE is_active = 1")
-        row = c.fetchone()
-        conn.close()
-        if row:
-            return row["system_prompt"], row["model"]
-    except:
-        pass
-    # Default
-    return ("You are 'Grainy Brain', a helpful, witty, and concise AI assistant. Answer naturally and conversationally.", "gemma3:latest")
+logger = get_logger("generate")
 
-def generate(state):
+def get_active_agent():
+    """
+    Returns the active agent as a dict with id, system_prompt and model.
+    Falls back to the built-in persona (id None) if none can be loaded.
+    """
+    return agent_registry.resolve()
+
+def get_state_agent(state) -> dict:
+    """The agent chosen for this request, carried in graph state, else the active one."""
+    return state.get("agent") or get_active_agent()
+
+def stream_llm(llm, messages, config=None):
+    """
+    Stream a chat completion and return the full text.
+
+    Streaming (rather than invoke) lets callbacks attached through `config`,
+    such as `graph_app.astream_events`, observe tokens as Ollama emits them.
+    """
+    chunks = []
+    for chunk in llm.stream(messages, config=config):
+        chunks.append(chunk.content)
+    return "".join(chunks)
+
+def summary_note(state) -> str:
+    """Persona prompt addition carrying the rolling summary of older turns."""
+    summary = state.get("summary")
+    if not summary:
+        return ""
+    return f"\n\nSummary of the earlier conversation:\n{summary}"
+
+def generate(state, config=None):
     """
     Generate answer
     """
-    print("---GENERATE---")
     question = state["question"]
     documents = state["documents"]
     
-    # Get active persona
-    persona_prompt, model_name = get_active_agent_prompt()
+    # Persona chosen for this request
+    agent = get_state_agent(state)
+    persona_prompt, model_name = agent["system_prompt"], agent["model"]
     
     # RAG generation
-    llm = ChatOllama(model=model_name, base_url=settings.OLLAMA_BASE_URL, temperature=0)
-    
-    # Format docs
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-    
-    context = format_docs(documents)
+    llm = get_chat_model(model_name, temperature=0)
     
-    prompt = f"""{persona_prompt}
+    # Merged, deduplicated passages within the model's context budget
+    context, sources = pack_context(documents, model_name)
     
-    IMPORTANT RULES:
-    1. Answer NATURALLY, based on the context provided below.
-    2. If the answer is not in the context, just say you don't know.
+    prompt = f"""IMPORTANT RULES:
+    1. Answer NATURALLY, based on the context provided below and the conversation so far.
+    2. If the answer is in neither, just say you don't know.
     3. Keep the answer concise.
     
     Context: {context}
@@ -56,12 +72,16 @@ def generate(state):
     # Using StrOutputParser for simple string generation
     # invoke takes a list of messages or a string prompt
     
-    messages = [HumanMessage(content=prompt)]
-    response = llm.invoke(messages)
+    # Persona and memory first, then the recent turns, then this turn with its context
+    messages = [SystemMessage(content=persona_prompt + summary_note(state))]
+    messages += history_messages(state.get("history") or [])
+    messages.append(HumanMessage(content=prompt))
+    generation = stream_llm(llm, messages, config)
+    log_event(logger, "generated", model=model_name, rag=True, chars=len(generation))
     
-    return {"documents": documents, "question": question, "generation": response.content}
+    return {"documents": documents, "question": question, "generation": generation, "sources": sources}
 
-def generate_casual(state):
+def generate_casual(state, config=None):
     """
     Generate casual conversation answer (No RAG)
 
@@ -71,17 +91,20 @@ def generate_casual(state):
     Returns:
         state (dict): New key added to state, generation, that contains LLM generation
     """
-    print("---GENERATE CASUAL---")
     question = state["question"]
     
-    # Get active persona logic
-    persona_prompt, model_name = get_active_agent_prompt()
+    # Persona chosen for this request
+    agent = get_state_agent(state)
+    persona_prompt, model_name = agent["system_prompt"], agent["model"]
     
     # Use the active model and prompt
-    llm = ChatOllama(model=model_name, base_url=settings.OLLAMA_BASE_URL, temperature=0.7)
+    llm = get_chat_model(model_name, temperature=0.7)
     
     # Construct messages with active persona
-    messages = [SystemMessage(content=persona_prompt), HumanMessage(content=question)]
-    response = llm.invoke(messages)
+    messages = [SystemMessage(content=persona_prompt + summary_note(state))]
+    messages += history_messages(state.get("history") or [])
+    messages.append(HumanMessage(content=question))
+    generation = stream_llm(llm, messages, config)
+    log_event(logger, "generated", model=model_name, rag=False, chars=len(generation))
     
-    return {"question": question, "generation": response.content}
+    return {"question": question, "generation": generation}
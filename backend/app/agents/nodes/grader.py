@@ -1,34 +1,38 @@
-from typing import Literal
+import logging
+from typing import List, Literal
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_community.chat_models import ChatOllama
 from pydantic import BaseModel, Field
 from app.core.config import settings
+from app.core.grading import band_grade, grade_thresholds
+from app.core.log import get_logger, log_event
+from app.core.metrics import GRADE_DECISIONS
+from app.core.ollama import get_chat_model
+from app.core.scheduler import OllamaBusyError, ollama_priority
+from app.db.db import run_db
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import PromptTemplate
 
+logger = get_logger("grader")
+
 class GradeDocuments(BaseModel):
     """Binary score for relevance check on retrieved documents."""
     binary_score: str = Field(description="Documents are relevant to the question, 'yes' or 'no'")
 
-def grade_documents(state):
-    """
-    Determines whether the retrieved documents are relevant to the question.
+class GradeDocumentList(BaseModel):
+    """Binary scores for a numbered list of retrieved documents."""
+    scores: List[str] = Field(description="One 'yes' or 'no' per document, in the order given")
 
-    Args:
-        state (dict): The current graph state
+def get_grader_llm():
+    return get_chat_model(settings.GRADER_MODEL, temperature=0, format="json")
+
+async def grade_pointwise(question, documents):
+    """
+    Grades each document with its own LLM call, running up to
+    GRADER_MAX_CONCURRENCY calls at once.
 
     Returns:
-        state (dict): Updates documents key with only filtered relevant documents
+        list[str]: 'yes' / 'no' per document, in order; None where the call failed
     """
-    print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
-    question = state["question"]
-    documents = state["documents"]
-    
-    # Score each doc
-    filtered_docs = []
-    
-    llm = ChatOllama(model=settings.GRADER_MODEL, base_url=settings.OLLAMA_BASE_URL, temperature=0, format="json")
-    
     prompt = PromptTemplate(
         template="""You are a grader assessing relevance of a retrieved document to a user question. \n 
         Here is the retrieved document: \n\n {document} \n\n
@@ -41,21 +45,122 @@ def grade_documents(state):
     )
     
     parser = JsonOutputParser(pydantic_object=GradeDocuments)
-    chain = prompt | llm | parser
-    
-    for d in documents:
-        try:
-            score = chain.invoke({"question": question, "document": d.page_content})
-            grade = score.get("binary_score", "no")
-        except Exception as e:
-            print(f"Grade error: {e}")
-            grade = "no"
-            
-        if grade == "yes":
-            print("---GRADE: DOCUMENT RELEVANT---")
-            filtered_docs.append(d)
+    chain = prompt | get_grader_llm() | parser
+    
+    inputs = [{"question": question, "document": d.page_content} for d in documents]
+    results = await chain.abatch(
+        inputs,
+        config={"max_concurrency": settings.GRADER_MAX_CONCURRENCY},
+        return_exceptions=True,
+    )
+    
+    grades = []
+    for score in results:
+        if isinstance(score, OllamaBusyError):
+            raise score
+        if isinstance(score, Exception):
+            log_event(logger, "grade_failed", logging.WARNING, error=str(score))
+            grades.append(None)
         else:
-            print("---GRADE: DOCUMENT NOT RELEVANT---")
-            continue
-            
+            grades.append(score.get("binary_score", "no"))
+    return grades
+
+async def grade_listwise(question, documents):
+    """
+    Grades every document in a single LLM call.
+
+    Returns:
+        list[str] | None: 'yes' / 'no' per document, or None if the model's
+        answer could not be matched to the documents
+    """
+    prompt = PromptTemplate(
+        template="""You are a grader assessing relevance of retrieved documents to a user question. \n
+        Here is the user question: {question} \n
+        Here are the retrieved documents: \n\n {documents} \n\n
+        For each document, if it contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
+        Give a binary score 'yes' or 'no' for every document, in the order given.
+        Return a JSON object with a single key 'scores' holding an array of exactly {count} strings, and no preamble or explanation.
+        """,
+        input_variables=["question", "documents", "count"],
+    )
+    
+    parser = JsonOutputParser(pydantic_object=GradeDocumentList)
+    chain = prompt | get_grader_llm() | parser
+    
+    numbered = "\n\n".join(f"[Document {i + 1}]\n{d.page_content}" for i, d in enumerate(documents))
+    try:
+        result = await chain.ainvoke({"question": question, "documents": numbered, "count": len(documents)})
+        scores = result.get("scores") if isinstance(result, dict) else result
+    except OllamaBusyError:
+        raise
+    except Exception as e:
+        log_event(logger, "listwise_grade_failed", logging.WARNING, error=str(e))
+        return None
+    
+    if not isinstance(scores, list) or len(scores) != len(documents):
+        log_event(logger, "listwise_grade_mismatch", logging.WARNING, scores=repr(scores), documents=len(documents))
+        return None
+    return [str(s).strip().lower() for s in scores]
+
+async def grade_with_llm(question, documents):
+    """Grades documents with the grader model in GRADER_MODE."""
+    grades = None
+    with ollama_priority("grading"):
+        if settings.GRADER_MODE == "listwise":
+            grades = await grade_listwise(question, documents)
+            if grades is None:
+                log_event(logger, "listwise_fallback", logging.WARNING)
+        if grades is None:
+            grades = await grade_pointwise(question, documents)
+    return grades
+
+async def grade_documents(state):
+    """
+    Determines whether the retrieved documents are relevant to the question.
+    Chunks whose similarity to the question falls in an automatic band are
+    decided by it; the grader model only sees the ambiguous middle.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Updates documents key with only filtered relevant documents
+    """
+    question = state["question"]
+    documents = state["documents"]
+    
+    if not documents:
+        return {"documents": [], "question": question}
+    
+    scores = state.get("scores") or {}
+    reject, accept = grade_thresholds.get()
+    grades = [band_grade(scores.get(d.id), reject, accept) for d in documents]
+    for grade in grades:
+        if grade is not None:
+            GRADE_DECISIONS.labels(method="auto_accept" if grade == "yes" else "auto_reject").inc()
+    
+    # Calibration also sends a sample of the decided chunks, to keep learning
+    to_grade = [i for i, grade in enumerate(grades) if grade is None or grade_thresholds.sample()]
+    if to_grade:
+        llm_grades = await grade_with_llm(question, [documents[i] for i in to_grade])
+        GRADE_DECISIONS.labels(method="llm").inc(len(to_grade))
+        for i, grade in zip(to_grade, llm_grades):
+            grades[i] = grade
+        
+        if settings.GRADER_CALIBRATION:
+            samples = [
+                (scores[documents[i].id], grade == "yes")
+                for i, grade in zip(to_grade, llm_grades)
+                if grade in ("yes", "no") and documents[i].id in scores
+            ]
+            if samples:
+                await run_db(grade_thresholds.record, samples)
+    
+    # Keep the relevant docs
+    filtered_docs = [d for d, grade in zip(documents, grades) if grade == "yes"]
+    log_event(
+        logger, "graded", mode=settings.GRADER_MODE, documents=len(documents),
+        llm_graded=len(to_grade), relevant=len(filtered_docs),
+    )
+    
     return {"documents": filtered_docs, "question": question}
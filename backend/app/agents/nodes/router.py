@@ -1,8 +1,22 @@
-from typing import Literal
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Literal, Optional, Tuple
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_community.chat_models import ChatOllama
+import numpy as np
 from pydantic import BaseModel, Field
+from app.core.cache import normalize_question
+from app.core.chroma import get_collection
 from app.core.config import settings
+from app.core.corpus import get_corpus_version
+from app.core.embeddings import get_embedding_model
+from app.core.log import get_logger, log_event
+from app.core.ollama import get_chat_model
+from app.core.retrieval import scope_filter, scope_key
+from app.core.scheduler import OllamaBusyError, ollama_priority
+
+logger = get_logger("router")
 
 class RouteQuery(BaseModel):
     """Route a user query to the most relevant datasource."""
@@ -11,29 +25,149 @@ class RouteQuery(BaseModel):
         description="Given a user question choose to route it to 'vectorstore' for retrieval or 'chat' for general conversation."
     )
 
-def route_question(state):
+# Labeled examples for the embedding tier; similarity to each set votes for its label
+ROUTE_EXEMPLARS = {
+    "vectorstore": [
+        "What does the document say about this?",
+        "Summarize the uploaded file.",
+        "What is my name?",
+        "When is the deadline mentioned in my notes?",
+        "How is this function implemented in the code?",
+        "What does this error code mean?",
+        "Which settings are described in the manual?",
+        "Find the section about installation.",
+        # Greetings in front of a lookup are still lookups
+        "Hey, what is my name?",
+        "Hi, what's in the PDF?",
+        "What can you do with parse_config?",
+    ],
+    "chat": [
+        "Hello, how are you?",
+        "Tell me a joke.",
+        "Thanks, that was helpful!",
+        "What can you do?",
+        "Write a short poem about the sea.",
+        "Good morning!",
+        "Who are you?",
+        "Let's just chat for a bit.",
+    ],
+}
+
+SMALLTALK_PATTERN = re.compile(
+    r"^(hi|hello|hey|yo|thanks|thank you|thx|cheers|bye|goodbye|ok|okay|cool|nice|great|lol"
+    r"|good (morning|afternoon|evening|night)|how are you|how's it going|what's up|who are you|what can you do)"
+    r"\b[\s\w',]{0,20}[.!?]*$",
+    re.IGNORECASE,
+)
+LOOKUP_PATTERN = re.compile(
+    r"\b(documents?|docs?|files?|pdfs?|uploaded|upload|according to|the manual|the spec)\b"
+    r"|\bmy (notes?|files?|docs?|documents?|data|records?|code|project|reports?|schedule|calendar)\b"
+    r"|\b(what|where|when|who)('s| is| was| are| were) my\b",
+    re.IGNORECASE,
+)
+# File names, snake_case / camelCase identifiers, call syntax and error codes.
+# camelCase needs two lowercase letters then a capitalized word, so brand
+# names like iPhone, eBay or macOS don't count.
+IDENTIFIER_PATTERN = re.compile(
+    r"\b\w+\.(py|js|ts|md|txt|pdf|json|ya?ml|java|go|rs|cpp|c|h|html?)\b"
+    r"|\b[a-z]+_[a-z0-9_]+\b|\b[a-z]{2,}[A-Z][a-z]+\w*\b|\w+\(\)|\b[A-Z]{1,5}-?\d{2,}\b"
+)
+
+class RouteCache:
+    """LRU of routing decisions keyed by normalized question and corpus version."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[str]:
+        with self._lock:
+            datasource = self._entries.get(key)
+            if datasource is not None:
+                self._entries.move_to_end(key)
+            return datasource
+
+    def put(self, key, datasource: str):
+        with self._lock:
+            self._entries[key] = datasource
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+route_cache = RouteCache(settings.ROUTER_CACHE_SIZE)
+
+_exemplar_lock = threading.Lock()
+_exemplar_vectors = {}
+
+def get_exemplar_vectors() -> dict:
+    """Embeds the exemplars once per process (the embedding cache makes restarts cheap)."""
+    with _exemplar_lock:
+        if not _exemplar_vectors:
+            emb_model = get_embedding_model()
+            for label, examples in ROUTE_EXEMPLARS.items():
+                _exemplar_vectors[label] = normalize_rows(np.asarray(emb_model.embed_documents(examples), dtype=np.float32))
+        return _exemplar_vectors
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+def route_by_rules(question: str, collection, filenames=None) -> Optional[Tuple[str, float]]:
     """
-    Route question to vectorstore or chat.
+    Cheap lexical checks. Returns (datasource, confidence) or None if no rule fires.
+    A question that looks like both small talk and a lookup gets a confidence
+    of 0, leaving it to the embedding tier.
+    """
+    if collection.count() == 0 or (filenames is not None and not filenames):
+        # Nothing to retrieve from
+        return "chat", 1.0
+    lookup = bool(LOOKUP_PATTERN.search(question) or IDENTIFIER_PATTERN.search(question))
+    smalltalk = bool(SMALLTALK_PATTERN.match(question.strip()))
+    if lookup and smalltalk:
+        # e.g. "hey, what is my name?": rule order shouldn't decide it
+        return "vectorstore", 0.0
+    if lookup:
+        return "vectorstore", 0.9
+    if smalltalk:
+        return "chat", 0.9
+    return None
 
-    Args:
-        state (dict): The current graph state
+def route_by_embedding(question: str, collection, filenames=None) -> Tuple[str, float]:
+    """
+    Votes with the nearest labeled exemplar, overridden by a collection
+    chunk (within `filenames`, when given) that is close enough to make the
+    question clearly about the corpus.
 
     Returns:
-        str: Next node to call
+        (datasource, confidence)
     """
-    print("---ROUTE QUESTION---")
-    question = state["question"]
-    
-    # Using qwen2.5-coder for structural output as requested
-    print(f"DEBUG: Router configured with base_url: {settings.OLLAMA_BASE_URL}")
-    print(f"DEBUG: Router configured with base_url: {settings.OLLAMA_BASE_URL}")
-    llm = ChatOllama(model=settings.ROUTER_MODEL, base_url=settings.OLLAMA_BASE_URL, temperature=0, format="json")
-    
+    query = normalize_rows(np.asarray(get_embedding_model().embed_query(question), dtype=np.float32))
+    exemplars = get_exemplar_vectors()
+    rag_sim = float(np.max(exemplars["vectorstore"] @ query))
+    chat_sim = float(np.max(exemplars["chat"] @ query))
+
+    nearest = collection.query(
+        query_embeddings=[query.tolist()], n_results=1, where=scope_filter(filenames), include=["embeddings"]
+    )
+    if nearest["embeddings"] and len(nearest["embeddings"][0]):
+        chunk = normalize_rows(np.asarray(nearest["embeddings"][0][0], dtype=np.float32))
+        corpus_sim = float(chunk @ query)
+        if corpus_sim >= settings.ROUTER_CORPUS_SIMILARITY:
+            return "vectorstore", corpus_sim
+
+    datasource = "vectorstore" if rag_sim >= chat_sim else "chat"
+    confidence = min(1.0, abs(rag_sim - chat_sim) / settings.ROUTER_EXEMPLAR_MARGIN)
+    return datasource, confidence
+
+def route_by_llm(question: str) -> str:
+    llm = get_chat_model(settings.ROUTER_MODEL, temperature=0, format="json")
+
     from langchain_core.output_parsers import JsonOutputParser
     from langchain_core.prompts import PromptTemplate
-    
+
     parser = JsonOutputParser(pydantic_object=RouteQuery)
-    
+
     prompt = PromptTemplate(
         template="""You are an expert at routing a user question to a vectorstore or casual chat.
 The vectorstore contains documents uploaded by the user.
@@ -48,20 +182,61 @@ Question: {question}
 """,
         input_variables=["question"],
     )
-    
+
     chain = prompt | llm | parser
-    
+
     try:
         source = chain.invoke({"question": question})
-        print(f"DEBUG: Router output: {source}")
-        datasource = source.get("datasource", "chat") # Default to chat if parsing fails key check
+        return source.get("datasource", "chat") # Default to chat if parsing fails key check
+    except OllamaBusyError:
+        raise
     except Exception as e:
-        print(f"ERROR in router parsing: {e}")
-        datasource = "chat"
-    
-    if datasource == "vectorstore":
-        print("---ROUTE QUERY TO RAG---")
-        return "retrieve"
-    else:
-        print("---ROUTE QUERY TO CHAT---")
-        return "generate_casual"
+        log_event(logger, "llm_route_failed", logging.WARNING, error=str(e))
+        return "chat"
+
+def route_question(state):
+    """
+    Route question to vectorstore or chat.
+
+    Tries, in order: the decision cache, lexical rules, the embedding
+    classifier, and only then ROUTER_MODEL when the cheaper tiers are not
+    confident enough.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        str: Next node to call
+    """
+    question = state["question"]
+    filenames = state.get("filenames")
+
+    cache_key = (normalize_question(question), scope_key(filenames), get_corpus_version())
+    datasource = route_cache.get(cache_key)
+    tier, confidence = "cache", 1.0
+
+    with ollama_priority("routing"):
+        if datasource is None and settings.ROUTER_FAST_PATH:
+            try:
+                collection = get_collection()
+                tier = "rules"
+                decision = route_by_rules(question, collection, filenames)
+                if decision is None or decision[1] < settings.ROUTER_MIN_CONFIDENCE:
+                    tier = "embedding"
+                    decision = route_by_embedding(question, collection, filenames)
+                if decision[1] >= settings.ROUTER_MIN_CONFIDENCE:
+                    datasource, confidence = decision
+            except OllamaBusyError:
+                raise
+            except Exception as e:
+                log_event(logger, "fast_path_failed", logging.WARNING, error=str(e))
+
+        if datasource is None:
+            tier, confidence = "llm", 1.0
+            datasource = route_by_llm(question)
+
+    if tier != "cache":
+        route_cache.put(cache_key, datasource)
+
+    log_event(logger, "routed", datasource=datasource, tier=tier, confidence=round(confidence, 2))
+    return "retrieve" if datasource == "vectorstore" else "generate_casual"
@@ -1,5 +1,7 @@
 
-from typing import List, TypedDict
+import asyncio
+from typing import Dict, List, Optional, TypedDict
+from langchain_core.documents import Document
 
 class GraphState(TypedDict):
     """
@@ -8,8 +10,24 @@ class GraphState(TypedDict):
     Attributes:
         question: question
         generation: LLM generation
-        documents: list of documents
+        documents: retrieved chunks, with their chunk id and metadata
+        scores: cosine similarity of each retrieved chunk to the question, by chunk id
+        history: recent turns of the thread, oldest first ({"role", "content"})
+        summary: rolling summary of the thread's older turns
+        agent: persona answering this request ({"id", "system_prompt", "model", "documents"})
+        filenames: documents retrieval is restricted to; None searches the whole corpus
+        sources: passages packed into the RAG prompt ({"filename", "chunk_ids", "tokens", "truncated"})
+        route: the router's decision, "retrieve" or "generate_casual"
+        prefetch: retrieval started alongside routing, for retrieve to pick up
     """
     question: str
     generation: str
-    documents: List[str]
+    documents: List[Document]
+    scores: Dict[str, float]
+    history: List[dict]
+    summary: str
+    agent: dict
+    filenames: Optional[List[str]]
+    sources: List[dict]
+    route: str
+    prefetch: Optional[asyncio.Task]
@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from app.core.cache import answer_cache
+from app.core.corpus import get_corpus_version
+from app.core.embeddings import get_embedding_model
+
+router = APIRouter()
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    return {
+        "corpus_version": get_corpus_version(),
+        "answers": answer_cache.stats(),
+        "embeddings": get_embedding_model().stats(),
+    }
+
+@router.delete("/cache")
+async def clear_answer_cache():
+    answer_cache.clear()
+    return {"status": "success"}
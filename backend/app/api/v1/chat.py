@@ -1,121 +1,480 @@
+import hashlib
+import json
+import logging
+import time
 import uuid
 from typing import Optional
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from app.agents.graph import graph_app
-from app.db.db import get_db_connection
+from app.core.agent_registry import agent_registry
+from app.core.cache import answer_cache, normalize_question
+from app.core.config import settings
+from app.core.corpus import get_corpus_version
+from app.core.embeddings import get_embedding_model
+from app.core.log import get_logger, log_event, set_request_id
+from app.core.metrics import REQUEST_SECONDS, observe, start_trace, timed
+from app.core.memory import delete_summary, load_memory, schedule_summary_update
+from app.core.retrieval import scope_key
+from app.core.scheduler import OllamaBusyError
+from app.core.singleflight import Flight, FlightGroup
+from app.db.db import connection, run_db, transaction
 
 router = APIRouter()
 
+logger = get_logger("chat")
+
 class ChatRequest(BaseModel):
     query: str
     thread_id: Optional[str] = None
     agent_id: Optional[str] = None
+    filenames: Optional[list[str]] = None  # restrict retrieval to these documents
 
 class ChatResponse(BaseModel):
     response: str
     thread_id: str
     context_used: list[str] = []
+    sources: list[dict] = []  # passages packed into the prompt
+    trace: Optional[dict] = None  # per-stage timings, when the request sent TRACE_HEADER
+
+# Graph nodes whose chat model tokens are forwarded to streaming clients
+GENERATION_NODES = ("generate", "generate_casual")
+
+# Concurrent identical turns share one graph run
+chat_flights = FlightGroup("chat")
+
+def start_thread_turn(c, request: ChatRequest) -> str:
+    """
+    Resolves (or creates) the thread for a request and saves the user message.
+    """
+    thread_id = request.thread_id
+    if not thread_id:
+        thread_id = str(uuid.uuid4())
+        # Create title from first few words of query
+        title = " ".join(request.query.split()[:5])
+        c.execute("INSERT INTO threads (id, title) VALUES (?, ?)", (thread_id, title))
+    
+    # Save User Message
+    save_message(c, thread_id, "user", request.query)
+    return thread_id
+
+def save_message(c, thread_id: str, role: str, content: str):
+    c.execute("INSERT INTO messages (id, thread_id, role, content) VALUES (?, ?, ?, ?)",
+              (str(uuid.uuid4()), thread_id, role, content))
+    # Keeps the sidebar ordered by latest activity (millisecond precision,
+    # still ordered correctly against older second-precision values)
+    c.execute("UPDATE threads SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = ?", (thread_id,))
+
+def record_user_turn(request: ChatRequest) -> str:
+    with transaction() as conn:
+        return start_thread_turn(conn, request)
+
+def document_scope(agent: dict, filenames: Optional[list]) -> Optional[list]:
+    """
+    Documents a turn retrieves from: the requested filenames, narrowed to
+    the agent's own scope when it has one. None means the whole corpus.
+    """
+    allowed = agent.get("documents")
+    if filenames is None:
+        return allowed
+    if allowed is None:
+        return list(filenames)
+    return [filename for filename in filenames if filename in allowed]
+
+async def prepare_turn(request: ChatRequest):
+    """
+    Resolves the agent (ChatRequest.agent_id, else the active one) and the
+    document scope, loads the thread's memory (before this turn's message
+    is saved), then records the user message.
+
+    Returns:
+        tuple: (thread_id, graph inputs)
+    """
+    try:
+        # Served from the in-process registry; only a cold cache reads SQLite
+        agent = agent_registry.resolve_loaded(request.agent_id)
+        if agent is None:
+            agent = await run_db(agent_registry.resolve, request.agent_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    except Exception:
+        # Answering as another persona would be wrong; let the client retry
+        raise HTTPException(status_code=503, detail="Agents are unavailable, try again shortly")
+    memory = await run_db(load_memory, request.thread_id)
+    thread_id = await run_db(record_user_turn, request)
+    inputs = {
+        "question": request.query, "history": memory["history"], "summary": memory["summary"], "agent": agent,
+        "filenames": document_scope(agent, request.filenames),
+    }
+    return thread_id, inputs
+
+def is_first_turn(inputs: dict) -> bool:
+    # Answers that depend on earlier turns are never cached or served from cache
+    return not inputs.get("history") and not inputs.get("summary")
+
+def record_message(thread_id: str, role: str, content: str):
+    with transaction() as conn:
+        save_message(conn, thread_id, role, content)
+
+async def lookup_cached_answer(question: str, agent: dict, filenames: Optional[list]):
+    """
+    Checks the answer cache for a question under the given agent and
+    document scope.
+
+    Returns:
+        tuple: (cached entry or None, cache scope, question embedding or None,
+        corpus version the answer will be computed against). Scope is None
+        when the cache is disabled.
+    """
+    if not settings.ANSWER_CACHE_ENABLED:
+        return None, None, None, None
+    
+    # Read before the graph runs, so an answer built from a corpus that
+    # changed mid-run isn't stored as fresh
+    corpus_version = get_corpus_version()
+    scope = (agent["id"], agent["model"], agent["system_prompt"], scope_key(filenames))
+    
+    embedding = None
+    if settings.ANSWER_CACHE_SEMANTIC:
+        try:
+            embedding = await run_in_threadpool(get_embedding_model().embed_query, question)
+        except Exception as e:
+            log_event(logger, "answer_cache_embedding_failed", logging.WARNING, error=str(e))
+    
+    return answer_cache.get(question, scope, embedding), scope, embedding, corpus_version
+
+def begin_request(http_request: Request):
+    """
+    Tags this request's log lines with a request id and, if the client sent
+    TRACE_HEADER, starts recording a per-stage timing trace.
+
+    Returns:
+        Trace | None
+    """
+    set_request_id(uuid.uuid4().hex[:12])
+    if http_request.headers.get(settings.TRACE_HEADER, "").lower() in ("1", "true", "yes"):
+        return start_trace()
+    return None
+
+def sse_event(event: str, data: dict) -> str:
+    """Formats a single Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def answer_chat(request: ChatRequest) -> ChatResponse:
+    thread_id, inputs = await prepare_turn(request)
+    
+    cached, scope, embedding, corpus_version = None, None, None, None
+    if is_first_turn(inputs):
+        cached, scope, embedding, corpus_version = await lookup_cached_answer(
+            request.query, inputs["agent"], inputs["filenames"]
+        )
+    if cached:
+        await run_db(record_message, thread_id, "assistant", cached.response)
+        return ChatResponse(
+            response=cached.response,
+            thread_id=thread_id,
+            context_used=cached.context_used,
+            sources=cached.sources
+        )
+
+    # Run the graph, or wait on an identical run already in flight
+    flight = join_graph_run(inputs)
+    try:
+        result = await flight.wait()
+    finally:
+        chat_flights.leave(flight)
+    
+    generation = result.get("generation", "")
+    documents = result.get("documents", [])
+    sources = result.get("sources", [])
+    
+    # Save Assistant Message
+    await run_db(record_message, thread_id, "assistant", generation)
+    schedule_summary_update(thread_id)
+    
+    context_preview = [doc.page_content[:200] for doc in documents] if documents else []
+    if scope is not None:
+        answer_cache.put(request.query, scope, corpus_version, generation, context_preview, embedding, sources)
+    
+    return ChatResponse(
+        response=generation,
+        thread_id=thread_id,
+        context_used=context_preview,
+        sources=sources
+    )
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
+    trace = begin_request(http_request)
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        
-        # Handle Thread
-        thread_id = request.thread_id
-        if not thread_id:
-            thread_id = str(uuid.uuid4())
-            # Create title from first few words of query
-            title = " ".join(request.query.split()[:5])
-            c.execute("INSERT INTO threads (id, title) VALUES (?, ?)", (thread_id, title))
-            conn.commit()
-        
-        # Save User Message
-        msg_id_user = str(uuid.uuid4())
-        c.execute("INSERT INTO messages (id, thread_id, role, content) VALUES (?, ?, ?, ?)",
-                  (msg_id_user, thread_id, "user", request.query))
-        conn.commit()
-
-        # Run Graph
-        # Hydrate history from DB
-        c.execute("SELECT role, content FROM messages WHERE thread_id = ? ORDER BY created_at ASC", (thread_id,))
-        rows = c.fetchall()
-        # Convert to LangChain format if needed, but for now passing as list of dicts or raw text depending on graph expectation.
-        # Our graph node `generate` uses `state["question"]`.
-        # To support history, we should ideally pass it. 
-        # But `generate.py` currently only looks at `question`. 
-        # For V2 Audit, let's keep it simple: Appending history to the question context or prompt is a quick fix 
-        # without rewriting the entire graph state definition which we haven't seen yet.
-        
-        # ACTUALLY: Let's just pass the raw inputs. The user asked to "fix" shortcuts. 
-        # True fix: Update graph to accept 'messages'. 
-        # For now, let's just proceed with the current simple graph but acknowledge the history constraint.
-        
-        inputs = {"question": request.query}
-        
-        inputs = {"question": request.query}
-        result = await graph_app.ainvoke(inputs) 
+        with timed(REQUEST_SECONDS, endpoint="chat"):
+            response = await answer_chat(request)
+        if trace is not None:
+            response.trace = trace.to_dict()
+        return response
+
+    except HTTPException:
+        raise
+    except OllamaBusyError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        log_event(logger, "chat_failed", logging.ERROR, exc_info=e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def graph_event(event: dict) -> Optional[tuple]:
+    """
+    Maps a graph_app.astream_events event to the (event, data) pair sent to
+    streaming clients, or None if the event is not forwarded.
+    """
+    kind = event["event"]
+    name = event["name"]
+    node = event.get("metadata", {}).get("langgraph_node")
+    
+    if kind == "on_chat_model_stream":
+        token = event["data"]["chunk"].content
+        if node in GENERATION_NODES and token:
+            return "token", {"content": token}
+        return None
+    
+    if kind != "on_chain_end":
+        return None
+    
+    output = event["data"].get("output")
+    if name == "route_question" and node == name:
+        return "routed", {"route": output["route"]}
+    if name == "retrieve" and node == name:
+        return "retrieved", {"count": len(output.get("documents", []))}
+    if name == "grade_documents" and node == name:
+        return "graded", {"count": len(output.get("documents", []))}
+    return None
+
+def flight_key(inputs: dict) -> tuple:
+    """
+    Turns with the same normalized question, agent, document scope, corpus
+    version and conversation memory would produce the same answer.
+    """
+    agent = inputs["agent"]
+    memory = json.dumps([inputs.get("history"), inputs.get("summary")], sort_keys=True)
+    return (
+        normalize_question(inputs["question"]),
+        agent["id"], agent["model"], agent["system_prompt"],
+        scope_key(inputs.get("filenames")),
+        get_corpus_version(),
+        hashlib.sha256(memory.encode("utf-8")).hexdigest(),
+    )
+
+async def run_graph(inputs: dict, flight: Flight) -> dict:
+    """
+    Runs the graph, publishing progress and generation tokens to the
+    flight as they happen.
+
+    Returns:
+        dict: generation, documents and sources of the generation node
+    """
+    result = {"generation": "", "documents": [], "sources": []}
+    async for event in graph_app.astream_events(inputs, version="v2"):
+        update = graph_event(event)
+        if update:
+            flight.publish(*update)
         
-        generation = result.get("generation", "")
-        documents = result.get("documents", [])
+        name = event["name"]
+        if (event["event"] == "on_chain_end" and name in GENERATION_NODES
+                and event.get("metadata", {}).get("langgraph_node") == name):
+            output = event["data"]["output"]
+            result = {
+                "generation": output.get("generation", ""),
+                "documents": output.get("documents", []) or [],
+                "sources": output.get("sources", []) or [],
+            }
+    return result
+
+def join_graph_run(inputs: dict) -> Flight:
+    """
+    Starts a graph run for this turn, or joins an identical one in flight.
+    Callers must pass the flight to chat_flights.leave when done with it.
+    """
+    key = flight_key(inputs) if settings.COALESCE_CHAT else uuid.uuid4()
+    return chat_flights.join(key, lambda flight: run_graph(inputs, flight))
+
+async def stream_chat_events(inputs: dict, thread_id: str, trace=None):
+    """
+    Runs the graph and yields SSE frames: pipeline progress first, then the
+    generation tokens as Ollama produces them. The assistant message is
+    persisted once the generation node completes. A client asking the same
+    question as a turn already running attaches to that run.
+    """
+    yield sse_event("thread", {"thread_id": thread_id})
+    started = time.perf_counter()
+    
+    generation = ""
+    documents = []
+    sources = []
+    try:
+        cached, scope, embedding, corpus_version = None, None, None, None
+        if is_first_turn(inputs):
+            cached, scope, embedding, corpus_version = await lookup_cached_answer(
+                inputs["question"], inputs["agent"], inputs["filenames"]
+            )
+        if cached:
+            yield sse_event("routed", {"route": "cache"})
+            yield sse_event("token", {"content": cached.response})
+            generation = cached.response
+        else:
+            # Replays what an identical run already produced, then follows it live
+            flight = join_graph_run(inputs)
+            try:
+                async for event, data in flight.follow():
+                    yield sse_event(event, data)
+            finally:
+                chat_flights.leave(flight)
+            generation = flight.result["generation"]
+            documents = flight.result["documents"]
+            sources = flight.result["sources"]
         
-        # Save Assistant Message
-        msg_id_ai = str(uuid.uuid4())
-        c.execute("INSERT INTO messages (id, thread_id, role, content) VALUES (?, ?, ?, ?)",
-                  (msg_id_ai, thread_id, "assistant", generation))
-        conn.commit()
-        conn.close()
+        await run_db(record_message, thread_id, "assistant", generation)
+        schedule_summary_update(thread_id)
+        observe(REQUEST_SECONDS, time.perf_counter() - started, endpoint="chat_stream")
         
-        context_preview = [doc.page_content[:200] for doc in documents] if documents else []
+        if cached:
+            context_preview, sources = cached.context_used, cached.sources
+        else:
+            context_preview = [doc.page_content[:200] for doc in documents]
+            if scope is not None:
+                answer_cache.put(inputs["question"], scope, corpus_version, generation, context_preview, embedding, sources)
         
-        return ChatResponse(
-            response=generation,
-            thread_id=thread_id,
-            context_used=context_preview
-        )
+        done = {
+            "response": generation,
+            "thread_id": thread_id,
+            "context_used": context_preview,
+            "sources": sources
+        }
+        if trace is not None:
+            done["trace"] = trace.to_dict()
+        yield sse_event("done", done)
+    except OllamaBusyError as e:
+        yield sse_event("error", {"detail": str(e), "status": 429})
+    except Exception as e:
+        log_event(logger, "chat_stream_failed", logging.ERROR, exc_info=e)
+        yield sse_event("error", {"detail": str(e)})
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """
+    Streaming variant of /chat using Server-Sent Events.
 
+    Events: thread, routed, retrieved, graded, token (repeated), done | error.
+    """
+    trace = begin_request(http_request)
+    try:
+        thread_id, inputs = await prepare_turn(request)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in chat endpoint: {e}")
+        log_event(logger, "chat_stream_failed", logging.ERROR, exc_info=e)
         raise HTTPException(status_code=500, detail=str(e))
+    
+    return StreamingResponse(
+        stream_chat_events(inputs, thread_id, trace),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class UnknownCursor(Exception):
+    pass
+
+def fetch_threads(before: Optional[str], limit: int):
+    """
+    One page of threads, most recently active first. `before` is the id
+    of the last thread on the previous page.
+    """
+    with connection() as conn:
+        if before is None:
+            rows = conn.execute(
+                "SELECT * FROM threads ORDER BY updated_at DESC, id DESC LIMIT ?", (limit,)
+            )
+        else:
+            cursor = conn.execute("SELECT updated_at, id FROM threads WHERE id = ?", (before,)).fetchone()
+            if cursor is None:
+                raise UnknownCursor(before)
+            rows = conn.execute(
+                """SELECT * FROM threads
+                   WHERE (updated_at, id) < (?, ?)
+                   ORDER BY updated_at DESC, id DESC LIMIT ?""",
+                (cursor["updated_at"], cursor["id"], limit),
+            )
+        return [dict(row) for row in rows]
+
+def fetch_thread_messages(thread_id: str, before: Optional[str], limit: int):
+    """
+    The newest `limit` messages of a thread older than message `before`,
+    returned oldest first. rowid breaks ties between messages saved within
+    the same second.
+    """
+    with connection() as conn:
+        if before is None:
+            bound, params = "", (thread_id, limit)
+        else:
+            cursor = conn.execute(
+                "SELECT created_at, rowid FROM messages WHERE id = ? AND thread_id = ?", (before, thread_id)
+            ).fetchone()
+            if cursor is None:
+                raise UnknownCursor(before)
+            bound, params = "AND (created_at, rowid) < (?, ?)", (thread_id, cursor["created_at"], cursor["rowid"], limit)
+        rows = conn.execute(
+            f"""SELECT id, thread_id, role, content, created_at FROM messages
+                WHERE thread_id = ? {bound}
+                ORDER BY created_at DESC, rowid DESC LIMIT ?""",
+            params,
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+def delete_thread_rows(thread_id: str):
+    with transaction() as conn:
+        # Delete messages first
+        conn.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+        # Delete thread
+        conn.execute("DELETE FROM threads WHERE id = ?", (thread_id,))
+        delete_summary(conn, thread_id)
 
 @router.get("/threads")
-async def get_threads():
+async def get_threads(
+    before: Optional[str] = Query(None, description="Id of the last thread on the previous page"),
+    limit: int = Query(settings.THREADS_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+):
+    """
+    Threads by latest activity, one page at a time. A page shorter than
+    `limit` is the last one.
+    """
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT * FROM threads ORDER BY updated_at DESC")
-        threads = [dict(row) for row in c.fetchall()]
-        conn.close()
-        return threads
+        return await run_db(fetch_threads, before, limit)
+    except UnknownCursor:
+        raise HTTPException(status_code=400, detail="Unknown thread in `before`")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/threads/{thread_id}/messages")
-async def get_thread_messages(thread_id: str):
+async def get_thread_messages(
+    thread_id: str,
+    before: Optional[str] = Query(None, description="Id of the oldest message already loaded"),
+    limit: int = Query(settings.MESSAGES_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+):
+    """
+    A thread's messages, paging backwards from the newest. Each page is in
+    chronological order; pass its first message id as `before` for older ones.
+    """
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT * FROM messages WHERE thread_id = ? ORDER BY created_at ASC", (thread_id,))
-        messages = [dict(row) for row in c.fetchall()]
-        conn.close()
-        return messages
+        return await run_db(fetch_thread_messages, thread_id, before, limit)
+    except UnknownCursor:
+        raise HTTPException(status_code=400, detail="Unknown message in `before`")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
 @router.delete("/threads/{thread_id}")
 async def delete_thread(thread_id: str):
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        
-        # Delete messages first
-        c.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
-        # Delete thread
-        c.execute("DELETE FROM threads WHERE id = ?", (thread_id,))
-        
-        conn.commit()
-        conn.close()
+        await run_db(delete_thread_rows, thread_id)
         return {"status": "success", "id": thread_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,69 +1,78 @@
+import logging
 from fastapi import APIRouter, HTTPException
-from app.db.db import get_db_connection
+from fastapi.concurrency import run_in_threadpool
+from app.db.db import connection, run_db, transaction
 from app.core.chroma import get_chroma_client
 from app.core.config import settings
+from app.core.corpus import bump_corpus_version
+from app.core.lexical import clear_index, delete_filename
+from app.core.log import get_logger, log_event
 
 router = APIRouter()
 
+logger = get_logger("documents")
+
+def fetch_documents():
+    with connection() as conn:
+        rows = conn.execute("SELECT id, filename, file_hash, chunk_count, created_at FROM documents ORDER BY created_at DESC")
+        return [dict(row) for row in rows]
+
+def reset_knowledge():
+    # 1. Truncate DB Table
+    with transaction() as conn:
+        conn.execute("DELETE FROM documents") # Truncate equivalent
+
+    # 2. Reset Chroma Collection
+    client = get_chroma_client()
+    try:
+        client.delete_collection(settings.CHROMA_COLLECTION_NAME)
+    except Exception:
+        pass # Collection might not exist
+    clear_index()
+    bump_corpus_version()
+
+    # Recreate empty
+    # client.create_collection(settings.CHROMA_COLLECTION_NAME)
+    # Actually, ingest will imply creation, or we can leave it empty.
+
+def remove_document(filename: str):
+    # Delete from DB
+    with transaction() as conn:
+        conn.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+
+    # Delete from Chroma
+    client = get_chroma_client()
+    collection = client.get_collection(settings.CHROMA_COLLECTION_NAME)
+
+    # Delete where metadata['filename'] == filename
+    # Chroma delete supports 'where' filter
+    collection.delete(where={"filename": filename})
+    delete_filename(filename)
+    bump_corpus_version()
+    # If older docs don't have this metadata, they won't be deleted.
+    # But for new system this works.
+
 @router.get("/documents")
 async def get_documents():
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT * FROM documents ORDER BY created_at DESC")
-        docs = [dict(row) for row in c.fetchall()]
-        conn.close()
-        return docs
+        return await run_db(fetch_documents)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/documents/reset")
 async def reset_brain():
     try:
-        # 1. Truncate DB Table
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("DELETE FROM documents") # Truncate equivalent
-        conn.commit()
-        conn.close()
-        
-        # 2. Reset Chroma Collection
-        client = get_chroma_client()
-        try:
-            client.delete_collection(settings.CHROMA_COLLECTION_NAME)
-        except Exception:
-            pass # Collection might not exist
-            
-        # Recreate empty
-        # client.create_collection(settings.CHROMA_COLLECTION_NAME)
-        # Actually, ingest will imply creation, or we can leave it empty.
-        
+        await run_in_threadpool(reset_knowledge)
         return {"status": "success", "message": "Brain Core reset complete."}
     except Exception as e:
-        print(f"Reset error: {e}")
+        log_event(logger, "reset_failed", logging.ERROR, exc_info=e)
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.delete("/documents/{filename}")
+@router.delete("/documents/{filename:path}")
 async def delete_document(filename: str):
     try:
-        # Delete from DB
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("DELETE FROM documents WHERE filename = ?", (filename,))
-        conn.commit()
-        
-        # Delete from Chroma
-        client = get_chroma_client()
-        collection = client.get_collection(settings.CHROMA_COLLECTION_NAME)
-        
-        # Delete where metadata['filename'] == filename
-        # Chroma delete supports 'where' filter
-        collection.delete(where={"filename": filename})
-        # If older docs don't have this metadata, they won't be deleted. 
-        # But for new system this works.
-        
-        conn.close()
+        await run_in_threadpool(remove_document, filename)
         return {"status": "success", "deleted": filename}
     except Exception as e:
-        print(f"Delete error: {e}")
+        log_event(logger, "delete_failed", logging.ERROR, exc_info=e, filename=filename)
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,59 +1,155 @@
 
-from fastapi import APIRouter
+import base64
+import json
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from app.core.chroma import get_collection
 from app.core.config import settings
+from app.core.knn import document_graph, knn_graph
 
 router = APIRouter()
 
-@router.get("/graph")
-async def get_graph_data():
+# Graph responses are level-of-detail: the overview has one node per
+# document; a document node expands into its chunks on demand. Every level
+# is paginated with an opaque cursor and carries ids and metadata only.
+
+def document_node_id(filename: str) -> str:
+    return f"doc:{filename}"
+
+def encode_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def make_link(source: str, target: str, similarity: Optional[float], weights: bool) -> dict:
+    link = {"source": source, "target": target}
+    if weights and similarity is not None:
+        link["value"] = round(similarity, 4)
+    return link
+
+def chunk_links(chunk_ids: list, own_filename: Optional[str], k: int, threshold: float, weights: bool) -> list:
     """
-    Returns nodes and links for the 3D/2D force graph.
-    Nodes are documents. Links could be semantic similarity.
+    kNN links of the given chunks. Neighbours in other documents are
+    attached to that document's node, so links stay valid when only the
+    overview and a few expanded documents are loaded.
     """
-    collection = get_collection()
-    
-    # Fetch all data (limit to recent/max for performance if needed)
-    # peek() is for preview, get() fetches.
-    data = collection.get(include=["metadatas", "documents", "embeddings"]) 
-    
-    ids = data["ids"]
-    metadatas = data["metadatas"]
-    # embeddings = data["embeddings"] # Vectors
-    
-    nodes = []
     links = []
-    
-    import random
-    
-    # Construct Nodes
-    for idx, doc_id in enumerate(ids):
-        # We use a simple structure for the visualizer
-        nodes.append({
-            "id": doc_id,
-            "name": f"Node {doc_id[:8]}", # Or metadata filename if available
-            "val": 1 # Size
-        })
-        
-    # Construct Links (Aesthetic Simulation)
-    # Since we don't have real semantic links calculated yet, we create a
-    # "Constellation" effect where nodes are randomly linked to 1-2 others
-    # to demonstrate the frontend capability.
-    if len(ids) > 1:
-        for i, source_id in enumerate(ids):
-            # Link to the next one to form a chain
-            target_i = (i + 1) % len(ids)
-            links.append({
-                "source": source_id,
-                "target": ids[target_i]
-            })
-            # Occasional random cross-link
-            if len(ids) > 4 and random.random() > 0.7:
-                 random_target = ids[random.randint(0, len(ids)-1)]
-                 if random_target != source_id:
-                     links.append({
-                        "source": source_id,
-                        "target": random_target
-                    })
-    
-    return {"nodes": nodes, "links": links}
+    for source, target, target_filename, similarity in knn_graph.neighbors(chunk_ids, k, threshold):
+        if own_filename is not None and target_filename != own_filename:
+            target = document_node_id(target_filename)
+        links.append(make_link(source, target, similarity, weights))
+    return links
+
+def graph_params(k: Optional[int], threshold: Optional[float]):
+    return (
+        settings.GRAPH_KNN_K if k is None else k,
+        settings.GRAPH_KNN_THRESHOLD if threshold is None else threshold,
+    )
+
+@router.get("/graph")
+async def get_graph_data(
+    level: str = Query("documents", pattern="^(documents|chunks)$", description="`documents` overview or flat `chunks`"),
+    cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+    limit: int = Query(settings.GRAPH_PAGE_SIZE, ge=1, le=settings.GRAPH_MAX_PAGE_SIZE),
+    k: Optional[int] = Query(None, ge=0, le=settings.GRAPH_KNN_MAX_K, description="Nearest neighbours linked per node"),
+    threshold: Optional[float] = Query(None, ge=-1.0, le=1.0, description="Minimum cosine similarity for a link"),
+    weights: bool = Query(True, description="Include the similarity of each link as its `value`"),
+):
+    """
+    Returns one page of nodes and links for the force graph.
+
+    The `documents` level has one node per file, linked by the similarity
+    of per-file centroid vectors; it reads only the documents table, so its
+    cost does not grow with the number of chunks. The `chunks` level pages
+    through every chunk with its nearest-neighbour links. Links are
+    returned with the page of their source node.
+    """
+    k, threshold = graph_params(k, threshold)
+    offset = decode_cursor(cursor)
+
+    try:
+        if level == "documents":
+            await run_in_threadpool(document_graph.sync)
+            documents = document_graph.documents()
+            page = documents[offset:offset + limit]
+            nodes = [
+                {"id": document_node_id(filename), "name": filename, "val": max(1, chunk_count), "type": "document", "chunks": chunk_count}
+                for filename, chunk_count in page
+            ]
+            links = [
+                make_link(document_node_id(source), document_node_id(target), similarity, weights)
+                for source, target, _, similarity in document_graph.graph.neighbors([f for f, _ in page], k, threshold)
+            ]
+            total = len(documents)
+        else:
+            await run_in_threadpool(knn_graph.sync)
+            page = knn_graph.nodes()[offset:offset + limit]
+            nodes = [
+                {"id": chunk_id, "name": filename or f"Node {chunk_id[:8]}", "val": 1, "type": "chunk", "document": document_node_id(filename)}
+                for chunk_id, filename in page
+            ]
+            links = chunk_links([chunk_id for chunk_id, _ in page], None, k, threshold, weights)
+            total = len(knn_graph.ids)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    next_offset = offset + len(page)
+    return {
+        "level": level,
+        "nodes": nodes,
+        "links": links,
+        "total": total,
+        "next_cursor": encode_cursor(next_offset) if next_offset < total else None,
+    }
+
+@router.get("/graph/documents/{filename:path}")
+async def expand_document(
+    filename: str,
+    cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+    limit: int = Query(settings.GRAPH_PAGE_SIZE, ge=1, le=settings.GRAPH_MAX_PAGE_SIZE),
+    k: Optional[int] = Query(None, ge=0, le=settings.GRAPH_KNN_MAX_K),
+    threshold: Optional[float] = Query(None, ge=-1.0, le=1.0),
+    weights: bool = Query(True),
+):
+    """
+    Expands a document node into a page of its chunks. Each chunk links to
+    its document node and to its nearest neighbours.
+    """
+    k, threshold = graph_params(k, threshold)
+    offset = decode_cursor(cursor)
+
+    try:
+        collection = get_collection()
+        # One extra row tells us whether another page exists
+        data = await run_in_threadpool(
+            collection.get, where={"filename": filename}, include=["metadatas"], limit=limit + 1, offset=offset
+        )
+        chunk_ids = data["ids"][:limit]
+        await run_in_threadpool(knn_graph.sync)
+        parent = document_node_id(filename)
+        nodes = [
+            {"id": chunk_id, "name": filename, "val": 1, "type": "chunk", "document": parent}
+            for chunk_id in chunk_ids
+        ]
+        links = [make_link(chunk_id, parent, None, weights) for chunk_id in chunk_ids]
+        links.extend(chunk_links(chunk_ids, filename, k, threshold, weights))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    has_more = len(data["ids"]) > limit
+    return {
+        "level": "chunks",
+        "document": parent,
+        "nodes": nodes,
+        "links": links,
+        "next_cursor": encode_cursor(offset + len(chunk_ids)) if has_more else None,
+    }
@@ -1,82 +1,174 @@
+from typing import List
 from fastapi import APIRouter, UploadFile, File, HTTPException
-from app.core.chroma import get_chroma_client
+from fastapi.concurrency import run_in_threadpool
 from app.core.config import settings
-from app.db.db import get_db_connection
-from langchain_chroma import Chroma
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_community.document_loaders import TextLoader, PyPDFLoader, BSHTMLLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from app.core.ingestion import file_summary
+from app.core.jobs import ingest_jobs
+from app.core.parsing import is_supported
 import os
+import posixpath
 import shutil
+import tarfile
 import uuid
+import zipfile
 
 router = APIRouter()
 
-@router.post("/ingest")
-async def ingest_file(file: UploadFile = File(...)):
-    try:
-        # Save temp file
-        file_id = str(uuid.uuid4())
-        file_path = f"/tmp/{file_id}_{file.filename}"
-        os.makedirs("/tmp", exist_ok=True)
-        
-        # Save upload to temp
+def store_upload(file: UploadFile) -> str:
+    """Copies an upload into UPLOAD_DIR and returns the stored path."""
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    file_path = os.path.join(settings.UPLOAD_DIR, f"{uuid.uuid4()}_{os.path.basename(file.filename)}")
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+    return file_path
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def safe_member_name(name: str):
+    """
+    Normalizes an archive member path, or returns None for entries that
+    would escape the extraction directory.
+    """
+    name = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+    if not name or name == "." or name.startswith("../") or name == "..":
+        return None
+    return name
+
+def archive_members(archive_path: str):
+    """
+    Yields (member name, size, open function) for every regular file in a
+    zip or tar archive.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, info.file_size, lambda info=info: archive.open(info)
+    else:
+        with tarfile.open(archive_path) as archive:
+            for member in archive:
+                # Regular files only: no links, devices or directories
+                if member.isfile():
+                    yield member.name, member.size, lambda member=member: archive.extractfile(member)
+
+def stage_bulk_uploads(files: List[UploadFile], job_dir: str):
+    """
+    Stores uploads under job_dir, expanding archives into their supported
+    members. Member filenames keep their path inside the archive.
+
+    Returns:
+        tuple: ([(filename, file_path)], [summaries of skipped entries])
+    """
+    staged = {}
+    skipped = []
+    
+    def add(filename: str, source):
+        if not is_supported(filename):
+            skipped.append(file_summary(filename, "skipped", error="Unsupported file type"))
+            return
+        if filename in staged:
+            skipped.append(file_summary(filename, "skipped", error="Duplicate filename in upload"))
+            return
+        file_path = os.path.join(job_dir, str(len(staged)))
         with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
+            shutil.copyfileobj(source, buffer)
+        staged[filename] = file_path
+    
+    for upload in files:
+        if not is_archive(upload.filename):
+            add(os.path.basename(upload.filename), upload.file)
+            continue
+        
+        archive_path = os.path.join(job_dir, f"archive_{uuid.uuid4()}")
+        with open(archive_path, "wb") as buffer:
+            shutil.copyfileobj(upload.file, buffer)
         try:
-            # Load and split
-            ext = os.path.splitext(file.filename)[1].lower()
-            
-            if ext == ".pdf":
-                loader = PyPDFLoader(file_path)
-            elif ext in [".html", ".htm"]:
-                loader = BSHTMLLoader(file_path)
-            elif ext in [".txt", ".md", ".py", ".js", ".ts", ".java", ".c", ".cpp", ".h", ".hpp", ".cs", ".go", ".rs", ".rb", ".php", ".swift", ".kt", ".json", ".yaml", ".yml", ".sh", ".bat", ".ps1", ".css", ".sql", ".xml"]:
-                 loader = TextLoader(file_path, autodetect_encoding=True)
-            else:
-                 raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext}. Supported: PDF, HTML, Code, Text, MD.")
+            total_size = 0
+            for name, size, open_member in archive_members(archive_path):
+                name = safe_member_name(name)
+                if name is None:
+                    continue
+                total_size += size
+                if total_size > settings.INGEST_MAX_ARCHIVE_BYTES:
+                    raise ValueError(f"{upload.filename} exceeds the {settings.INGEST_MAX_ARCHIVE_BYTES} byte extraction limit")
+                with open_member() as source:
+                    add(name, source)
+        except (tarfile.TarError, zipfile.BadZipFile) as e:
+            skipped.append(file_summary(upload.filename, "failed", error=f"Unreadable archive: {e}"))
+        finally:
+            os.remove(archive_path)
     
-            docs = loader.load()
-            
-            text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-                chunk_size=1000, chunk_overlap=200
-            )
-            doc_splits = text_splitter.split_documents(docs)
-            
-            # Add filename metadata for deletion
-            for doc in doc_splits:
-                doc.metadata["filename"] = file.filename
-            
-            # Embed and Store
-            emb_model = OllamaEmbeddings(base_url=settings.OLLAMA_BASE_URL, model=settings.EMBEDDING_MODEL)
-            
-            # We iterate to persist to the same chroma db path
-            client = get_chroma_client()
-            vectorstore = Chroma(
-                client=client,
-                collection_name=settings.CHROMA_COLLECTION_NAME,
-                embedding_function=emb_model,
-            )
-            
-            vectorstore.add_documents(documents=doc_splits)
-            
-            # Save to DB
-            conn = get_db_connection()
-            c = conn.cursor()
-            doc_id = str(uuid.uuid4())
-            c.execute("INSERT INTO documents (id, filename) VALUES (?, ?)", (doc_id, file.filename))
-            conn.commit()
-            conn.close()
-            
-            return {"status": "success", "filename": file.filename, "chunks": len(doc_splits)}
+    return list(staged.items()), skipped
 
-        finally:
-            # Cleanup guaranteed
-            if os.path.exists(file_path):
-                os.remove(file_path)
+@router.post("/ingest", status_code=202)
+async def ingest_file(file: UploadFile = File(...)):
+    """
+    Stores the upload and queues it for background ingestion.
+    Poll /ingest/jobs/{job_id} for progress.
+    """
+    if not is_supported(file.filename):
+        ext = os.path.splitext(file.filename)[1].lower()
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext}. Supported: PDF, HTML, Code, Text, MD.")
 
-    except HTTPException as he:
-        raise he
+    try:
+        file_path = await run_in_threadpool(store_upload, file)
+        job = ingest_jobs.submit(file.filename, file_path)
+        return {"status": "queued", "filename": file.filename, "job_id": job.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/ingest/bulk", status_code=202)
+async def ingest_bulk(files: List[UploadFile] = File(...)):
+    """
+    Queues many files, and/or zip and tar archives of files, as one job.
+    Parsing runs across a process pool; the job result lists a summary
+    per file.
+    """
+    job_dir = os.path.join(settings.UPLOAD_DIR, f"bulk_{uuid.uuid4()}")
+    try:
+        os.makedirs(job_dir)
+        staged, skipped = await run_in_threadpool(stage_bulk_uploads, files, job_dir)
+    except ValueError as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not staged:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail={"message": "No supported files in upload", "files": skipped})
+    
+    job = ingest_jobs.submit_bulk(staged, job_dir, skipped)
+    return {"status": "queued", "job_id": job.id, "files": len(staged), "skipped": skipped}
+
+@router.get("/ingest/jobs")
+async def get_ingest_jobs():
+    return [job.to_dict() for job in ingest_jobs.list()]
+
+@router.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.post("/ingest/jobs/{job_id}/cancel")
+async def cancel_ingest_job(job_id: str):
+    job = ingest_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.post("/ingest/jobs/{job_id}/retry")
+async def retry_ingest_job(job_id: str):
+    try:
+        job = ingest_jobs.retry(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
@@ -0,0 +1,107 @@
+
+import json
+import logging
+import threading
+from typing import Optional
+from app.core.log import get_logger, log_event
+from app.db.db import connection
+
+logger = get_logger("agents")
+
+DEFAULT_PERSONA_PROMPT = "You are 'Grainy Brain', a helpful, witty, and concise AI assistant. Answer naturally and conversationally."
+DEFAULT_AGENT = {"id": None, "name": "Default", "system_prompt": DEFAULT_PERSONA_PROMPT, "model": "gemma3:latest", "documents": None}
+
+def decode_documents(value: Optional[str]) -> Optional[list]:
+    """An agent's document scope as stored in agents.documents (None: the whole corpus)."""
+    return None if value is None else json.loads(value)
+
+def encode_documents(documents: Optional[list]) -> Optional[str]:
+    return None if documents is None else json.dumps(documents)
+
+class AgentRegistry:
+    """
+    In-process copy of the agents table, so persona lookups on the chat path
+    never touch SQLite. Loaded on first use and reloaded after the agent
+    endpoints call `invalidate()`.
+    """
+
+    def __init__(self):
+        self._agents = None  # id -> agent dict
+        self._active_id = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._agents = None
+            self._generation += 1
+
+    def _load(self):
+        with self._lock:
+            if self._agents is not None:
+                return self._agents, self._active_id
+            generation = self._generation
+
+        with connection() as conn:
+            rows = conn.execute("SELECT id, name, system_prompt, model, documents, is_active FROM agents").fetchall()
+        agents = {
+            row["id"]: {
+                "id": row["id"], "name": row["name"], "system_prompt": row["system_prompt"], "model": row["model"],
+                "documents": decode_documents(row["documents"]),
+            }
+            for row in rows
+        }
+        active_id = next((row["id"] for row in rows if row["is_active"]), None)
+
+        with self._lock:
+            # Don't install a snapshot that an invalidation raced past
+            if generation == self._generation:
+                self._agents, self._active_id = agents, active_id
+        return agents, active_id
+
+    def get(self, agent_id: str) -> Optional[dict]:
+        agents, _ = self._load()
+        return agents.get(agent_id)
+
+    @staticmethod
+    def _pick(agents: dict, active_id: Optional[str], agent_id: Optional[str]) -> dict:
+        if agent_id is not None:
+            if agent_id not in agents:
+                raise KeyError(agent_id)
+            return agents[agent_id]
+        return agents.get(active_id) or dict(DEFAULT_AGENT)
+
+    def resolve(self, agent_id: Optional[str] = None) -> dict:
+        """
+        The agent to answer with: `agent_id` when given, otherwise the
+        active agent, otherwise the built-in persona. The built-in persona
+        also stands in for the active agent when the agents can't be loaded.
+
+        Raises:
+            KeyError: if `agent_id` is given but unknown
+            Exception: if `agent_id` is given and the agents can't be loaded
+        """
+        try:
+            agents, active_id = self._load()
+        except Exception as e:
+            log_event(logger, "agents_load_failed", logging.ERROR, exc_info=e)
+            if agent_id is not None:
+                raise
+            return dict(DEFAULT_AGENT)
+        return self._pick(agents, active_id, agent_id)
+
+    def resolve_loaded(self, agent_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Like resolve, but only from the in-process copy, so it never touches
+        SQLite. Returns None when the copy isn't loaded.
+
+        Raises:
+            KeyError: if `agent_id` is given but unknown
+        """
+        with self._lock:
+            agents, active_id = self._agents, self._active_id
+        if agents is None:
+            return None
+        return self._pick(agents, active_id, agent_id)
+
+agent_registry = AgentRegistry()
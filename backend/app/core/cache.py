@@ -0,0 +1,152 @@
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.corpus import get_corpus_version
+
+def normalize_question(question: str) -> str:
+    """Lowercases, drops punctuation and collapses whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+@dataclass
+class CachedAnswer:
+    response: str
+    context_used: list
+    sources: list = field(default_factory=list)
+    embedding: Optional[np.ndarray] = None
+    created_at: float = field(default_factory=time.monotonic)
+
+class AnswerCache:
+    """
+    LRU/TTL cache of final answers in front of the graph.
+
+    Entries are scoped by (agent id, model, system prompt, document scope),
+    so switching persona or documents never serves another scope's answer,
+    and the whole cache is dropped when the global corpus version moves on.
+    An answer is only stored if the corpus hasn't changed since its lookup.
+    Lookups match the normalized question exactly and, when semantic
+    matching is on, fall back to the most similar cached question in the
+    same scope.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._corpus_version = get_corpus_version()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def _sync_corpus_version(self):
+        # Caller holds the lock
+        version = get_corpus_version()
+        if version != self._corpus_version:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._corpus_version = version
+
+    def _expired(self, entry: CachedAnswer) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def get(self, question: str, scope: tuple, embedding=None) -> Optional[CachedAnswer]:
+        key = (scope, normalize_question(question))
+        with self._lock:
+            self._sync_corpus_version()
+
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry
+
+            if embedding is not None:
+                entry_key = self._nearest(scope, np.asarray(embedding, dtype=np.float32))
+                if entry_key is not None:
+                    self._entries.move_to_end(entry_key)
+                    self.semantic_hits += 1
+                    return self._entries[entry_key]
+
+            self.misses += 1
+            return None
+
+    def _nearest(self, scope: tuple, embedding: np.ndarray):
+        candidates = [
+            (k, e) for k, e in self._entries.items()
+            if k[0] == scope and e.embedding is not None and not self._expired(e)
+        ]
+        if not candidates:
+            return None
+
+        matrix = np.stack([e.embedding for _, e in candidates])
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(embedding) or 1.0)
+        similarities = matrix @ embedding / np.where(norms == 0, 1.0, norms)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return candidates[best][0]
+        return None
+
+    def put(self, question: str, scope: tuple, corpus_version: int, response: str, context_used: list, embedding=None, sources=None):
+        """
+        Stores an answer computed against `corpus_version` (read before the
+        answer was generated). Skipped if the corpus has changed since.
+        """
+        key = (scope, normalize_question(question))
+        entry = CachedAnswer(
+            response=response,
+            context_used=context_used,
+            sources=sources or [],
+            embedding=np.asarray(embedding, dtype=np.float32) if embedding is not None else None,
+        )
+        with self._lock:
+            self._sync_corpus_version()
+            if corpus_version != self._corpus_version:
+                self.stale_puts += 1
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "corpus_version": self._corpus_version,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
+
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+)
@@ -1,18 +1,23 @@
 
+import threading
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 from app.core.config import settings
+from app.core.metrics import TimedCollection
 
 class ChromaClient:
     _instance = None
+    _lock = threading.RLock()
 
     @classmethod
     def get_instance(cls):
-        if cls._instance is None:
-            cls._instance = chromadb.PersistentClient(
-                path=settings.CHROMA_DB_DIR,
-                settings=ChromaSettings(allow_reset=True, anonymized_telemetry=False)
-            )
+        # Startup tasks and ingest workers can race to create the client
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = chromadb.PersistentClient(
+                    path=settings.CHROMA_DB_DIR,
+                    settings=ChromaSettings(allow_reset=True, anonymized_telemetry=False)
+                )
         return cls._instance
 
 def get_chroma_client():
@@ -20,4 +25,8 @@ def get_chroma_client():
 
 def get_collection():
     client = get_chroma_client()
-    return client.get_or_create_collection(name=settings.CHROMA_COLLECTION_NAME)
+    # Concurrent first calls can both try to create the collection
+    with ChromaClient._lock:
+        collection = client.get_or_create_collection(name=settings.CHROMA_COLLECTION_NAME)
+    # Calls are timed into nurag_chroma_seconds
+    return TimedCollection(collection)
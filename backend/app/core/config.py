@@ -1,3 +1,4 @@
+from typing import Dict
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import os
 
@@ -11,12 +12,118 @@ class Settings(BaseSettings):
     ROUTER_MODEL: str = "qwen2.5-coder:7b"
     EMBEDDING_MODEL: str = "nomic-embed-text:latest"
     
+    # Ingestion
+    UPLOAD_DIR: str = "./uploads"  # uploads wait here until their job finishes
+    INGEST_WORKERS: int = 2
+    INGEST_CHUNK_SIZE: int = 1000
+    INGEST_CHUNK_OVERLAP: int = 200
+    INGEST_EMBED_BATCH_SIZE: int = 32  # chunks per Chroma upsert, and per Ollama request with OLLAMA_BATCH_EMBED
+    INGEST_EMBED_CONCURRENCY: int = 4  # embedding batches in flight to Ollama, across all jobs
+    INGEST_PARSE_PROCESSES: int = 0  # parser worker processes; 0 means one per CPU
+    INGEST_BULK_FLUSH_CHUNKS: int = 1024  # chunks pooled across files before an embed/upsert pass
+    INGEST_MAX_ARCHIVE_BYTES: int = 1024 * 1024 * 1024  # uncompressed size limit for uploaded archives
+    INGEST_JOB_HISTORY: int = 200  # finished jobs kept for /ingest/jobs; the oldest are forgotten first
+    INGEST_JOB_TTL_SECONDS: int = 24 * 3600  # finished jobs older than this are forgotten
+    
+    # Routing
+    ROUTER_FAST_PATH: bool = True  # try rules and embeddings before asking ROUTER_MODEL
+    ROUTER_MIN_CONFIDENCE: float = 0.5
+    ROUTER_EXEMPLAR_MARGIN: float = 0.1  # similarity gap between labels that counts as fully confident
+    ROUTER_CORPUS_SIMILARITY: float = 0.7  # nearest chunk this close means the question is about the corpus
+    ROUTER_CACHE_SIZE: int = 2048
+    SPECULATIVE_RETRIEVAL: bool = False  # retrieve while the router decides; discarded if it picks casual chat
+    
+    # Retrieval
+    HYBRID_RETRIEVAL: bool = True  # fuse Chroma results with the SQLite FTS5 keyword index
+    RETRIEVAL_K: int = 4  # chunks passed on to grading
+    RETRIEVAL_VECTOR_K: int = 8
+    RETRIEVAL_LEXICAL_K: int = 8
+    RRF_K: int = 60
+    RRF_VECTOR_WEIGHT: float = 1.0
+    RRF_LEXICAL_WEIGHT: float = 1.0
+    
+    # Context packing
+    CONTEXT_MAX_TOKENS: int = 2000  # retrieved context per RAG prompt
+    CONTEXT_MODEL_MAX_TOKENS: Dict[str, int] = {}  # per-model overrides, e.g. {"gemma3:1b": 1000}
+    CONTEXT_MIN_OVERLAP_CHARS: int = 20  # shortest suffix/prefix match treated as chunk overlap
+    
+    # Knowledge graph
+    GRAPH_KNN_K: int = 5  # default neighbours linked per chunk
+    GRAPH_KNN_MAX_K: int = 20  # neighbours kept in the cached graph; upper bound for ?k=
+    GRAPH_KNN_THRESHOLD: float = 0.5  # default minimum cosine similarity for a link
+    GRAPH_KNN_BLOCK_SIZE: int = 1024  # rows per similarity block (memory is block x chunks)
+    GRAPH_PAGE_SIZE: int = 500  # nodes per /graph page
+    GRAPH_MAX_PAGE_SIZE: int = 5000
+    
+    # Grading
+    GRADER_MODE: str = "pointwise"  # "pointwise" (one call per chunk) or "listwise" (one call for all)
+    GRADER_MAX_CONCURRENCY: int = 4
+    GRADER_ACCEPT_SIMILARITY: float = 0.85  # chunks at least this similar to the question are kept without the grader
+    GRADER_REJECT_SIMILARITY: float = 0.35  # chunks at most this similar are dropped without the grader
+    GRADER_CALIBRATION: bool = False  # learn the two thresholds from logged grader decisions
+    GRADER_CALIBRATION_SAMPLE_RATE: float = 0.1  # share of auto-graded chunks still sent to the grader, to keep learning
+    GRADER_CALIBRATION_PRECISION: float = 0.95  # agreement with the grader required at the edge of each automatic band
+    GRADER_CALIBRATION_MIN_SAMPLES: int = 200  # logged decisions needed before thresholds are learned
+    GRADER_CALIBRATION_WINDOW: int = 5000  # most recent decisions learned from; older ones are pruned
+    GRADER_CALIBRATION_INTERVAL: int = 100  # new decisions between recalibrations
+    
     # Storage
     CHROMA_DB_DIR: str = "./chroma_db"
     CHROMA_COLLECTION_NAME: str = "neural_rag_knowledge"
+    EMBEDDING_CACHE_PATH: str = "./embedding_cache.db"
+    EMBEDDING_CACHE_MEMORY_SIZE: int = 10000  # vectors kept in the in-process LRU tier
+    DB_POOL_SIZE: int = 8  # pooled SQLite connections, also the size of the database executor
+    DB_BUSY_TIMEOUT_MS: int = 5000  # how long a writer waits for the write lock
+    DB_CACHE_SIZE_KB: int = 20000  # page cache per connection
+    DB_MMAP_SIZE: int = 256 * 1024 * 1024
+    
+    # History
+    THREADS_PAGE_SIZE: int = 50
+    MESSAGES_PAGE_SIZE: int = 100
+    HISTORY_MAX_PAGE_SIZE: int = 500
+    
+    # Conversation memory
+    MEMORY_ENABLED: bool = True
+    MEMORY_HISTORY_TOKENS: int = 1500  # recent turns sent verbatim
+    MEMORY_MAX_MESSAGES: int = 50  # upper bound on messages read per turn
+    MEMORY_SUMMARY_MODEL: str = "gemma3:1b"
+    MEMORY_SUMMARY_MAX_TOKENS: int = 400  # length target for the rolling summary
+    MEMORY_SUMMARY_BATCH_TOKENS: int = 2000  # older turns folded per summarizer call
+    
+    # Answer cache
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_TTL_SECONDS: int = 3600
+    ANSWER_CACHE_SEMANTIC: bool = False  # also match near-identical questions by embedding
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+    
+    # Request coalescing
+    COALESCE_CHAT: bool = True  # concurrent identical questions share one graph run
+    COALESCE_RETRIEVAL: bool = True  # concurrent identical queries share embedding and retrieval
+    
+    # Observability
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True  # one JSON object per log line; false for plain text
+    TRACE_HEADER: str = "X-Debug-Trace"  # send it on /chat to get a per-stage timing breakdown
     
     # Ollama
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+    OLLAMA_MAX_CONNECTIONS: int = 16  # pooled keep-alive connections, shared by every model
+    OLLAMA_CONNECT_TIMEOUT: float = 5.0
+    OLLAMA_TIMEOUT: float = 300.0  # seconds to wait for the next bytes of a response
+    OLLAMA_MODEL_TIMEOUTS: Dict[str, float] = {}  # per-model overrides of OLLAMA_TIMEOUT
+    OLLAMA_KEEP_ALIVE: str = "30m"  # how long Ollama keeps a model loaded after a call
+    OLLAMA_MODEL_KEEP_ALIVE: Dict[str, str] = {}  # per-model overrides, e.g. {"gemma3:latest": "-1m"}
+    OLLAMA_WARMUP: bool = True  # load the router, grader, chat and embedding models at startup
+    OLLAMA_BATCH_EMBED: bool = False  # one /api/embed request per batch; re-ingest existing documents after switching
+
+    # Ollama scheduler
+    OLLAMA_MAX_CONCURRENCY: int = 8  # calls in flight to Ollama across all models
+    OLLAMA_MODEL_CONCURRENCY: int = 4  # calls in flight per model
+    OLLAMA_MODEL_CONCURRENCY_OVERRIDES: Dict[str, int] = {}  # per-model caps, e.g. {"gemma3:latest": 2}
+    OLLAMA_QUEUE_MAX: int = 32  # waiting interactive calls per model before requests get a 429
+    OLLAMA_QUEUE_TIMEOUT: float = 120.0  # longest an interactive call waits for a slot
+    OLLAMA_PRIORITY_AGING: float = 30.0  # seconds of waiting that promote a call one priority class; 0 disables
 
     model_config = SettingsConfigDict(case_sensitive=True)
 
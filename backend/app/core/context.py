@@ -0,0 +1,130 @@
+from app.core.config import settings
+from app.core.log import get_logger, log_event
+from app.core.memory import estimate_tokens
+
+logger = get_logger("context")
+
+# Context packing for the RAG prompt. Chunks are split with an overlap, so
+# neighbours retrieved together repeat each other's edges; they are stitched
+# back into one passage per run of adjacent chunks, chunks contained in
+# another are dropped, and passages are added in relevance order until the
+# model's context budget is spent.
+
+MIN_TRIMMED_TOKENS = 50  # smallest remaining budget worth filling with a cut passage
+
+def context_budget(model: str) -> int:
+    return settings.CONTEXT_MODEL_MAX_TOKENS.get(model, settings.CONTEXT_MAX_TOKENS)
+
+def source_name(doc) -> str:
+    return doc.metadata.get("filename") or doc.metadata.get("source") or "unknown"
+
+def overlap_length(a: str, b: str, min_chars: int) -> int:
+    """
+    Length of the longest suffix of `a` that is also a prefix of `b`, or 0
+    if it is shorter than `min_chars`.
+    """
+    probe = b[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    pos = a.find(probe, max(0, len(a) - len(b)))
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(probe, pos + 1)
+    return 0
+
+def merge_passages(documents) -> list:
+    """
+    Groups chunks of the same file into passages, stitching adjacent chunks
+    over their shared overlap. Each passage keeps the rank of its most
+    relevant chunk.
+
+    Returns:
+        list[dict]: {"filename", "text", "chunk_ids", "rank"}, best rank first
+    """
+    min_chars = settings.CONTEXT_MIN_OVERLAP_CHARS
+    chunks = []
+    for rank, doc in enumerate(documents):
+        text = doc.page_content.strip()
+        filename = source_name(doc)
+        # A chunk repeated inside a more relevant one adds nothing
+        duplicate = next((c for c in chunks if c["filename"] == filename and text in c["text"]), None)
+        if duplicate is not None:
+            if doc.id not in duplicate["chunk_ids"]:
+                duplicate["chunk_ids"].append(doc.id)
+            continue
+        chunks.append({"filename": filename, "text": text, "chunk_ids": [doc.id], "rank": rank})
+
+    # successor[i] = (j, overlap) when chunk j continues chunk i
+    successor = {}
+    has_predecessor = set()
+    for i, a in enumerate(chunks):
+        best = None
+        for j, b in enumerate(chunks):
+            if i == j or j in has_predecessor or a["filename"] != b["filename"]:
+                continue
+            overlap = overlap_length(a["text"], b["text"], min_chars)
+            if overlap and (best is None or overlap > best[1]):
+                best = (j, overlap)
+        if best is not None:
+            successor[i] = best
+            has_predecessor.add(best[0])
+
+    passages = []
+    visited = set()
+    starts = [i for i in range(len(chunks)) if i not in has_predecessor]
+    # Every chunk in a cycle has a predecessor; start those anywhere
+    for i in starts + list(range(len(chunks))):
+        if i in visited:
+            continue
+        passage = dict(chunks[i], chunk_ids=list(chunks[i]["chunk_ids"]))
+        visited.add(i)
+        while i in successor and successor[i][0] not in visited:
+            i, overlap = successor[i]
+            visited.add(i)
+            passage["text"] += chunks[i]["text"][overlap:]
+            passage["chunk_ids"] += chunks[i]["chunk_ids"]
+            passage["rank"] = min(passage["rank"], chunks[i]["rank"])
+        passages.append(passage)
+    return sorted(passages, key=lambda p: p["rank"])
+
+def trim_to_tokens(text: str, tokens: int) -> str:
+    # Leave room for the ellipsis and the estimate rounding up
+    cut = text[:max(0, tokens - 2) * 4]
+    # End on a word boundary when there is one
+    space = cut.rfind(" ")
+    if space > len(cut) // 2:
+        cut = cut[:space]
+    return cut + " ..."
+
+def pack_context(documents, model: str):
+    """
+    Builds the context block for a RAG prompt within the model's token budget.
+
+    Args:
+        documents: graded chunks, most relevant first
+        model: the chat model the prompt is for
+
+    Returns:
+        tuple: (context text, sources), where sources lists the passages
+        included as {"filename", "chunk_ids", "tokens", "truncated"}
+    """
+    budget = context_budget(model)
+    used = 0
+    parts, sources = [], []
+    for passage in merge_passages(documents):
+        text = passage["text"]
+        tokens = estimate_tokens(text)
+        truncated = False
+        if used + tokens > budget:
+            remaining = budget - used
+            if remaining < MIN_TRIMMED_TOKENS or any(s["truncated"] for s in sources):
+                continue
+            text = trim_to_tokens(text, remaining)
+            tokens, truncated = estimate_tokens(text), True
+        used += tokens
+        parts.append(f"[{passage['filename']}]\n{text}")
+        sources.append({"filename": passage["filename"], "chunk_ids": passage["chunk_ids"], "tokens": tokens, "truncated": truncated})
+
+    log_event(logger, "context_packed", chunks=len(documents), passages=len(parts), tokens=used, budget=budget)
+    return "\n\n".join(parts), sources
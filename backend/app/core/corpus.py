@@ -0,0 +1,29 @@
+
+import threading
+
+class CorpusVersion:
+    """
+    Monotonic counter bumped whenever the knowledge collection changes.
+
+    Anything derived from the corpus (cached answers, routing decisions)
+    records the version it was computed against and is stale once the
+    counter moves on.
+    """
+    _lock = threading.Lock()
+    _version = 0
+
+    @classmethod
+    def get(cls) -> int:
+        return cls._version
+
+    @classmethod
+    def bump(cls) -> int:
+        with cls._lock:
+            cls._version += 1
+            return cls._version
+
+def get_corpus_version() -> int:
+    return CorpusVersion.get()
+
+def bump_corpus_version() -> int:
+    return CorpusVersion.bump()
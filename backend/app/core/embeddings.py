@@ -0,0 +1,157 @@
+
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from app.core.config import settings
+from app.core.ollama import ollama_clients
+from app.core.singleflight import CallGroup
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of an embedding model.
+
+    Vectors are keyed by (model, sha256(kind, text)) and looked up in two
+    tiers: an in-memory LRU, then a SQLite table that survives restarts.
+    Only texts missing from both tiers are sent to the underlying model.
+    The kind ("query" or "document") is part of the key because the model
+    embeds a text differently as a query than as a document.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, db_path: str, memory_size: int):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._query_calls = CallGroup("embed_query")
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS embeddings (
+            model TEXT,
+            text_hash TEXT,
+            vector BLOB,
+            PRIMARY KEY (model, text_hash)
+        ) WITHOUT ROWID''')
+        self._conn.commit()
+
+    @staticmethod
+    def text_hash(text: str, kind: str) -> str:
+        return hashlib.sha256(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys: List[str]) -> dict:
+        """Returns {key: vector} for every key found in either tier."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            self.memory_hits += len(found)
+
+            missing = [k for k in keys if k not in found]
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, *batch],
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f", blob).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+        return found
+
+    def _store(self, items: dict):
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, key, array("f", vector).tobytes()) for key, vector in items.items()],
+            )
+            self._conn.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.text_hash(t, "document") for t in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        # Embed each distinct missing text once
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+        if pending:
+            vectors = self.underlying.embed_documents(list(pending.values()))
+            computed = dict(zip(pending.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+            with self._lock:
+                self.misses += len(pending)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.text_hash(text, "query")
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        if settings.COALESCE_RETRIEVAL:
+            # Concurrent misses for the same text share one model call
+            return self._query_calls.do(key, lambda: self._embed_missing_query(key, text))
+        return self._embed_missing_query(key, text)
+
+    def _embed_missing_query(self, key: str, text: str) -> List[float]:
+        vector = self.underlying.embed_query(text)
+        self._store({key: vector})
+        with self._lock:
+            self.misses += 1
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_name,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+class EmbeddingModel:
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            # /api/embed vectors are normalized, so they're cached apart from /api/embeddings ones
+            model_name = settings.EMBEDDING_MODEL + (" (embed)" if settings.OLLAMA_BATCH_EMBED else "")
+            cls._instance = CachedEmbeddings(
+                ollama_clients.embeddings(settings.EMBEDDING_MODEL),
+                model_name=model_name,
+                db_path=settings.EMBEDDING_CACHE_PATH,
+                memory_size=settings.EMBEDDING_CACHE_MEMORY_SIZE,
+            )
+        return cls._instance
+
+def get_embedding_model():
+    return EmbeddingModel.get_instance()
@@ -0,0 +1,142 @@
+import random
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.log import get_logger, log_event
+from app.core.metrics import GRADER_THRESHOLDS
+from app.db.db import transaction
+
+logger = get_logger("grading")
+
+# Score-aware grading. A chunk whose similarity to the question is at least
+# the accept threshold is kept, one at most the reject threshold is dropped,
+# and only the band in between goes to the grader model.
+#
+# With GRADER_CALIBRATION the thresholds are learned instead: every grader
+# verdict is logged with the chunk's similarity, a sample of the chunks the
+# bands decided is graded anyway so the log covers the whole range, and the
+# bands are re-fitted so that even at their edges the automatic decisions
+# agree with the grader at least GRADER_CALIBRATION_PRECISION of the time.
+
+BAND_EDGE_SAMPLES = 20  # verdicts nearest a band's edge that must agree with it
+
+def band_grade(similarity: Optional[float], reject: float, accept: float) -> Optional[str]:
+    """'yes' / 'no' when the similarity decides the grade, None when the grader must."""
+    if similarity is None:
+        return None
+    if similarity >= accept:
+        return "yes"
+    if similarity <= reject:
+        return "no"
+    return None
+
+def band_edge(ordered: List[Tuple[float, bool]], grade: bool, precision: float) -> Optional[float]:
+    """
+    Walks verdicts from the confident end of a band inwards and returns the
+    last similarity at which the BAND_EDGE_SAMPLES verdicts just passed still
+    agree with `grade` at `precision`, or None if they never do.
+    """
+    edge = None
+    window, agreed = deque(), 0
+    for similarity, relevant in ordered:
+        window.append(relevant == grade)
+        agreed += window[-1]
+        if len(window) > BAND_EDGE_SAMPLES:
+            agreed -= window.popleft()
+        if len(window) == BAND_EDGE_SAMPLES:
+            if agreed / BAND_EDGE_SAMPLES < precision:
+                break
+            edge = similarity
+    return edge
+
+def learn_thresholds(samples: List[Tuple[float, bool]], precision: float) -> Tuple[float, float]:
+    """
+    Fits the automatic bands to logged verdicts.
+
+    Args:
+        samples: (similarity, relevant) per graded chunk
+        precision: share of verdicts near each band's edge it must agree with
+
+    Returns:
+        tuple: (reject, accept). A band the data can't support is disabled
+        (-inf / inf).
+    """
+    accept = band_edge(sorted(samples, reverse=True), True, precision)
+    reject = band_edge(sorted(samples), False, precision)
+    accept = float("inf") if accept is None else accept
+    reject = float("-inf") if reject is None else reject
+
+    # Overlapping bands would contradict each other; trust neither
+    if reject >= accept:
+        return float("-inf"), float("inf")
+    return reject, accept
+
+class GradeThresholds:
+    """Current automatic grading bands, configured or learned."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reject = settings.GRADER_REJECT_SIMILARITY
+        self.accept = settings.GRADER_ACCEPT_SIMILARITY
+        self._since_calibration = 0
+        self._publish()
+
+    def _publish(self):
+        GRADER_THRESHOLDS.labels(bound="reject").set(self.reject)
+        GRADER_THRESHOLDS.labels(bound="accept").set(self.accept)
+
+    def get(self) -> Tuple[float, float]:
+        """Returns (reject, accept)."""
+        with self._lock:
+            return self.reject, self.accept
+
+    def sample(self) -> bool:
+        """Whether to send a chunk the bands decided to the grader anyway."""
+        return settings.GRADER_CALIBRATION and random.random() < settings.GRADER_CALIBRATION_SAMPLE_RATE
+
+    def record(self, samples: List[Tuple[float, bool]]):
+        """Logs grader verdicts and recalibrates every GRADER_CALIBRATION_INTERVAL of them."""
+        with transaction() as conn:
+            conn.executemany(
+                "INSERT INTO grader_decisions (grader_model, embedding_model, similarity, relevant) VALUES (?, ?, ?, ?)",
+                [(settings.GRADER_MODEL, settings.EMBEDDING_MODEL, s, int(r)) for s, r in samples],
+            )
+        with self._lock:
+            self._since_calibration += len(samples)
+            due = self._since_calibration >= settings.GRADER_CALIBRATION_INTERVAL
+            if due:
+                self._since_calibration = 0
+        if due:
+            self.calibrate()
+
+    def calibrate(self):
+        """Re-fits the bands to the most recent verdicts for the current models."""
+        models = (settings.GRADER_MODEL, settings.EMBEDDING_MODEL)
+        window = settings.GRADER_CALIBRATION_WINDOW
+        with transaction() as conn:
+            rows = conn.execute(
+                """SELECT similarity, relevant FROM grader_decisions
+                   WHERE grader_model = ? AND embedding_model = ?
+                   ORDER BY id DESC LIMIT ?""",
+                (*models, window),
+            ).fetchall()
+            conn.execute(
+                """DELETE FROM grader_decisions WHERE grader_model = ? AND embedding_model = ? AND id <= (
+                       SELECT id FROM grader_decisions WHERE grader_model = ? AND embedding_model = ?
+                       ORDER BY id DESC LIMIT 1 OFFSET ?)""",
+                (*models, *models, window),
+            )
+        if len(rows) < settings.GRADER_CALIBRATION_MIN_SAMPLES:
+            return
+
+        reject, accept = learn_thresholds(
+            [(row["similarity"], bool(row["relevant"])) for row in rows], settings.GRADER_CALIBRATION_PRECISION
+        )
+        with self._lock:
+            self.reject, self.accept = reject, accept
+            self._publish()
+        log_event(logger, "grader_calibrated", samples=len(rows), reject=reject, accept=accept)
+
+grade_thresholds = GradeThresholds()
@@ -0,0 +1,317 @@
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from app.core.chroma import get_collection
+from app.core.config import settings
+from app.core.corpus import bump_corpus_version
+from app.core.embeddings import get_embedding_model
+from app.core.lexical import delete_chunks, index_chunks
+from app.core.log import get_logger, log_event
+from app.core.metrics import INGEST_STAGE_SECONDS, observe, timed
+from app.core.parsing import timed_load_and_split
+from app.core.scheduler import ollama_priority
+from app.db.db import connection, transaction
+
+logger = get_logger("ingestion")
+
+# Shared by all ingestion jobs so INGEST_EMBED_CONCURRENCY bounds total load on Ollama
+_embed_executor = ThreadPoolExecutor(max_workers=settings.INGEST_EMBED_CONCURRENCY, thread_name_prefix="embed")
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+class IngestCancelled(Exception):
+    pass
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """
+    Process pool for parsing and splitting, which are CPU-bound and hold
+    the GIL. Spawned rather than forked, as the parent runs many threads.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=settings.INGEST_PARSE_PROCESSES or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+def shutdown_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(filename: str, text: str) -> str:
+    """Deterministic chunk id: identical text in the same file always maps to the same vector."""
+    return hashlib.sha256(f"{filename}\0{text}".encode("utf-8")).hexdigest()
+
+def existing_ids(collection, ids) -> set:
+    """Returns the subset of ids already stored in the collection."""
+    found = set()
+    for start in range(0, len(ids), 500):
+        found.update(collection.get(ids=ids[start:start + 500], include=[])["ids"])
+    return found
+
+def embed_and_store(doc_splits, ids, job=None, check_cancelled=None):
+    """
+    Embeds chunks in batches of INGEST_EMBED_BATCH_SIZE with up to
+    INGEST_EMBED_CONCURRENCY batches in flight, upserting each batch into
+    Chroma as soon as its vectors arrive. A batch is one Ollama request
+    with OLLAMA_BATCH_EMBED, otherwise one request per chunk, sent in turn. At most a window of batches is
+    held in memory, and batches stored before a failure stay stored.
+    Chunks whose ids are already in the collection are skipped, so
+    retrying a failed job resumes where it stopped.
+
+    Returns:
+        int: number of chunks embedded by this call
+    """
+    collection = get_collection()
+    emb_model = get_embedding_model()
+    batch_size = settings.INGEST_EMBED_BATCH_SIZE
+    
+    existing = existing_ids(collection, ids)
+    pending = [(i, d) for i, d in zip(ids, doc_splits) if i not in existing]
+    if job is not None:
+        job.add_progress(len(doc_splits) - len(pending))
+    
+    def embed(texts):
+        with ollama_priority("background"), timed(INGEST_STAGE_SECONDS, stage="embed"):
+            return emb_model.embed_documents(texts)
+    
+    def store(batch, vectors):
+        with timed(INGEST_STAGE_SECONDS, stage="store"):
+            collection.upsert(
+                ids=[i for i, _ in batch],
+                embeddings=vectors,
+                documents=[d.page_content for _, d in batch],
+                metadatas=[d.metadata for _, d in batch],
+            )
+        if job is not None:
+            job.add_progress(len(batch))
+    
+    started = time.perf_counter()
+    in_flight = {}
+    try:
+        for start in range(0, len(pending), batch_size):
+            if check_cancelled:
+                check_cancelled()
+            batch = pending[start:start + batch_size]
+            future = _embed_executor.submit(embed, [d.page_content for _, d in batch])
+            in_flight[future] = batch
+            
+            if len(in_flight) >= settings.INGEST_EMBED_CONCURRENCY:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(in_flight.pop(future), future.result())
+        
+        for future in list(in_flight):
+            store(in_flight.pop(future), future.result())
+    finally:
+        for future in in_flight:
+            future.cancel()
+    
+    elapsed = time.perf_counter() - started
+    if pending:
+        log_event(
+            logger, "chunks_embedded", job_id=job.id if job is not None else None, chunks=len(pending),
+            seconds=round(elapsed, 3), chunks_per_sec=round(len(pending) / max(elapsed, 1e-9), 1),
+        )
+    return len(pending)
+
+class FilePlan:
+    """What ingesting one parsed file will change in the collection."""
+
+    def __init__(self, filename: str, file_hash: str, chunks: dict, previous: set):
+        self.filename = filename
+        self.file_hash = file_hash
+        self.chunks = chunks  # chunk id -> Document
+        self.added = [i for i in chunks if i not in previous]
+        self.stale = list(previous - set(chunks))
+
+def plan_file(collection, filename: str, file_hash: str, doc_splits) -> FilePlan:
+    # Duplicate passages within a file collapse onto one chunk id
+    chunks = {}
+    for doc in doc_splits:
+        chunks.setdefault(chunk_id(filename, doc.page_content), doc)
+    previous = set(collection.get(where={"filename": filename}, include=[])["ids"])
+    return FilePlan(filename, file_hash, chunks, previous)
+
+def centroid_blob(vectors) -> bytes:
+    """Mean of a file's chunk embeddings, as float32 bytes for the documents table."""
+    return np.asarray(vectors, dtype=np.float32).mean(axis=0).astype(np.float32).tobytes()
+
+def record_document(filename: str, file_hash: str, chunk_count: int, centroid: bytes = None):
+    with transaction() as conn:
+        # One row per filename; also collapses rows left by pre-hashing re-uploads
+        conn.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+        conn.execute("INSERT INTO documents (id, filename, file_hash, chunk_count, centroid) VALUES (?, ?, ?, ?, ?)",
+                     (str(uuid.uuid4()), filename, file_hash, chunk_count, centroid))
+
+def recorded_documents(filenames) -> dict:
+    """Returns {filename: (file_hash, chunk_count)} for documents recorded exactly once."""
+    hashes = {}
+    counts = {}
+    filenames = list(filenames)
+    with connection() as conn:
+        for start in range(0, len(filenames), 500):
+            batch = filenames[start:start + 500]
+            rows = conn.execute(f"SELECT filename, file_hash, chunk_count FROM documents WHERE filename IN ({','.join('?' * len(batch))})", batch)
+            for row in rows:
+                hashes[row["filename"]] = (row["file_hash"], row["chunk_count"] or 0)
+                counts[row["filename"]] = counts.get(row["filename"], 0) + 1
+    return {f: h for f, h in hashes.items() if counts[f] == 1}
+
+def file_summary(filename: str, status: str, chunks: int = 0, added: int = 0, removed: int = 0, error=None) -> dict:
+    return {"filename": filename, "status": status, "chunks": chunks, "added": added, "removed": removed, "error": error}
+
+def ingest_files(files, job=None):
+    """
+    Runs the ingestion pipeline for stored uploads: hash, parse and split
+    (in the process pool), embed, store and record each document.
+
+    Ingestion is incremental. A file whose hash matches the recorded
+    document is skipped; otherwise only chunks whose content-derived id is
+    new get embedded, and chunks the new version no longer contains are
+    deleted once the new ones are stored. Chunks from many small files are
+    pooled into shared embedding batches of up to INGEST_BULK_FLUSH_CHUNKS.
+
+    Args:
+        files: list of (filename, file_path)
+        job: optional IngestJob that receives stage and progress updates
+            and can request cancellation between batches
+
+    Returns:
+        list[dict]: one summary per file, in input order
+    """
+    def check_cancelled():
+        if job is not None and job.cancel_event.is_set():
+            raise IngestCancelled()
+    
+    summaries = {}
+    
+    if job is not None:
+        job.set_stage("hashing")
+    with timed(INGEST_STAGE_SECONDS, stage="hash"):
+        hashes = {filename: file_sha256(path) for filename, path in files}
+    recorded = recorded_documents(hashes)
+    changed = []
+    for filename, path in files:
+        file_hash, chunk_count = recorded.get(filename, (None, 0))
+        if file_hash == hashes[filename]:
+            summaries[filename] = file_summary(filename, "unchanged", chunk_count)
+        else:
+            changed.append((filename, path))
+    if job is not None:
+        job.add_files_done(len(files) - len(changed))
+    check_cancelled()
+    
+    collection = get_collection()
+    pending_plans = []
+    
+    def flush():
+        docs, ids = [], []
+        for plan in pending_plans:
+            ids.extend(plan.chunks)
+            docs.extend(plan.chunks.values())
+        embed_and_store(docs, ids, job, check_cancelled)
+        with timed(INGEST_STAGE_SECONDS, stage="index"):
+            index_chunks((i, d.metadata["filename"], d.page_content) for i, d in zip(ids, docs))
+        with timed(INGEST_STAGE_SECONDS, stage="finalize"):
+            stored = collection.get(ids=ids, include=["embeddings"]) if ids else {"ids": [], "embeddings": []}
+            vectors = dict(zip(stored["ids"], stored["embeddings"]))
+            for plan in pending_plans:
+                if plan.stale:
+                    collection.delete(ids=plan.stale)
+                    delete_chunks(plan.stale)
+                plan_vectors = [vectors[i] for i in plan.chunks if i in vectors]
+                centroid = centroid_blob(plan_vectors) if plan_vectors else None
+                record_document(plan.filename, plan.file_hash, len(plan.chunks), centroid)
+                summaries[plan.filename] = file_summary(
+                    plan.filename, "ingested", len(plan.chunks), len(plan.added), len(plan.stale)
+                )
+        if job is not None:
+            job.add_files_done(len(pending_plans))
+        pending_plans.clear()
+    
+    if job is not None:
+        job.set_stage("parsing")
+    pool = get_parse_pool()
+    futures = {
+        pool.submit(timed_load_and_split, path, filename, settings.INGEST_CHUNK_SIZE, settings.INGEST_CHUNK_OVERLAP): filename
+        for filename, path in changed
+    }
+    try:
+        for future in as_completed(futures):
+            check_cancelled()
+            filename = futures[future]
+            try:
+                doc_splits, parse_seconds = future.result()
+                observe(INGEST_STAGE_SECONDS, parse_seconds, stage="parse")
+            except BrokenProcessPool:
+                # A parser process died (e.g. OOM); start a fresh pool for the next job
+                shutdown_parse_pool()
+                raise
+            except Exception as e:
+                log_event(
+                    logger, "parse_failed", logging.WARNING,
+                    job_id=job.id if job is not None else None, filename=filename, error=str(e),
+                )
+                summaries[filename] = file_summary(filename, "failed", error=str(e))
+                if job is not None:
+                    job.add_files_done(1)
+                continue
+            
+            plan = plan_file(collection, filename, hashes[filename], doc_splits)
+            pending_plans.append(plan)
+            if job is not None:
+                job.set_stage("embedding")
+                job.add_total(len(plan.chunks))
+            if sum(len(p.chunks) for p in pending_plans) >= settings.INGEST_BULK_FLUSH_CHUNKS:
+                flush()
+        if pending_plans:
+            flush()
+    except IngestCancelled:
+        for future in futures:
+            future.cancel()
+        # Roll back files that were not finalized to their previous version
+        added = [i for plan in pending_plans for i in plan.added]
+        stored = existing_ids(collection, added)
+        if stored:
+            collection.delete(ids=list(stored))
+        raise
+    finally:
+        if changed:
+            bump_corpus_version()
+    
+    return [summaries[filename] for filename, _ in files]
+
+def ingest_file_path(file_path: str, filename: str, job=None) -> dict:
+    """
+    Ingests a single stored upload. Raises if the file cannot be parsed.
+
+    Returns:
+        dict: the file's summary (see ingest_files)
+    """
+    summary = ingest_files([(filename, file_path)], job)[0]
+    if summary["status"] == "failed":
+        raise ValueError(summary["error"])
+    return summary
@@ -0,0 +1,244 @@
+
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from app.core.config import settings
+from app.core.ingestion import IngestCancelled, ingest_file_path, ingest_files, shutdown_parse_pool
+from app.core.log import get_logger, log_event
+
+logger = get_logger("jobs")
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+class IngestJob:
+    """
+    State of one background ingestion. Mutated by the worker thread and
+    read by the API, so all updates go through the lock.
+
+    A job covers either a single upload (`bulk` False, the result is that
+    file's summary) or many files (the result lists a summary per file).
+    """
+
+    def __init__(self, files: list, storage_path: str, bulk: bool = False, skipped: Optional[list] = None):
+        self.id = str(uuid.uuid4())
+        self.files = files  # [(filename, file_path)]
+        self.storage_path = storage_path  # upload file or directory, removed when the job is done with it
+        self.bulk = bulk
+        self.skipped = skipped or []  # summaries for uploads rejected before queueing
+        self.status = "queued"  # queued | running | succeeded | failed | cancelled
+        self.stage = "queued"
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.files_done = 0
+        self.error = None
+        self.result = None
+        self.attempts = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def filename(self) -> str:
+        if self.bulk:
+            return f"{len(self.files)} files"
+        return self.files[0][0]
+
+    def set_stage(self, stage: str, chunks_total: Optional[int] = None):
+        with self._lock:
+            self.stage = stage
+            if chunks_total is not None:
+                self.chunks_total = chunks_total
+
+    def add_total(self, chunks: int):
+        with self._lock:
+            self.chunks_total += chunks
+
+    def add_progress(self, chunks: int):
+        with self._lock:
+            self.chunks_embedded += chunks
+
+    def add_files_done(self, files: int):
+        with self._lock:
+            self.files_done += files
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            return {
+                "id": self.id,
+                "filename": self.filename,
+                "bulk": self.bulk,
+                "status": self.status,
+                "stage": self.stage,
+                "files_done": self.files_done,
+                "files_total": len(self.files),
+                "chunks_embedded": self.chunks_embedded,
+                "chunks_total": self.chunks_total,
+                "chunks_per_sec": round(self.chunks_embedded / elapsed, 2) if elapsed > 0 else 0.0,
+                "error": self.error,
+                "result": self.result,
+                "attempts": self.attempts,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+class IngestJobManager:
+    """
+    Runs ingestion jobs on a bounded worker pool so uploads return
+    immediately and parsing/embedding never blocks the event loop.
+    """
+
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, filename: str, file_path: str) -> IngestJob:
+        return self._add(IngestJob([(filename, file_path)], file_path))
+
+    def submit_bulk(self, files: list, storage_dir: str, skipped: Optional[list] = None) -> IngestJob:
+        return self._add(IngestJob(files, storage_dir, bulk=True, skipped=skipped))
+
+    def _add(self, job: IngestJob) -> IngestJob:
+        with self._lock:
+            evicted = self._evict_finished()
+            self._jobs[job.id] = job
+        for old in evicted:
+            # A failed job's upload was kept for a retry that can no longer happen
+            if old.status == "failed":
+                self._remove_storage(old)
+        self._schedule(job)
+        return job
+
+    def _evict_finished(self) -> list:
+        """
+        Forgets finished jobs older than INGEST_JOB_TTL_SECONDS and, beyond
+        INGEST_JOB_HISTORY, the oldest finished ones. Call with the lock held.
+
+        Returns:
+            list[IngestJob]: the jobs forgotten
+        """
+        now = time.time()
+        finished = sorted(
+            (j for j in self._jobs.values() if j.status in FINISHED and j.finished_at is not None),
+            key=lambda j: j.finished_at,
+        )
+        excess = len(finished) - settings.INGEST_JOB_HISTORY
+        evicted = [
+            job for i, job in enumerate(finished)
+            if i < excess or now - job.finished_at > settings.INGEST_JOB_TTL_SECONDS
+        ]
+        for job in evicted:
+            del self._jobs[job.id]
+        return evicted
+
+    def _schedule(self, job: IngestJob):
+        self._executor.submit(self._run, job)
+
+    def _run(self, job: IngestJob):
+        with job._lock:
+            if job.cancel_event.is_set():
+                return
+            job.status = "running"
+            job.attempts += 1
+            job.started_at = time.time()
+            job.finished_at = None
+            job.error = None
+            job.chunks_total = 0
+            job.chunks_embedded = 0
+            job.files_done = 0
+
+        result = None
+        try:
+            if job.bulk:
+                result = {"files": ingest_files(job.files, job) + job.skipped}
+            else:
+                filename, file_path = job.files[0]
+                result = ingest_file_path(file_path, filename, job)
+            status, error = "succeeded", None
+        except IngestCancelled:
+            status, error = "cancelled", None
+        except Exception as e:
+            log_event(logger, "ingest_job_failed", logging.ERROR, exc_info=e, job_id=job.id, chunks=job.chunks_embedded)
+            status, error = "failed", str(e)
+
+        with job._lock:
+            job.status = status
+            job.stage = status
+            job.error = error
+            job.result = result
+            job.finished_at = time.time()
+            elapsed = job.finished_at - job.started_at
+            chunks = job.chunks_embedded
+        log_event(
+            logger, "ingest_job_finished", job_id=job.id, status=status, files=len(job.files), chunks=chunks,
+            seconds=round(elapsed, 3), chunks_per_sec=round(chunks / max(elapsed, 1e-9), 1),
+        )
+
+        # Failed uploads are kept so the job can be retried
+        if status != "failed":
+            self._remove_storage(job)
+
+    @staticmethod
+    def _remove_storage(job: IngestJob):
+        if os.path.isdir(job.storage_path):
+            shutil.rmtree(job.storage_path, ignore_errors=True)
+        elif os.path.exists(job.storage_path):
+            os.remove(job.storage_path)
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> list:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job._lock:
+            if job.status not in ("queued", "running"):
+                return job
+            job.cancel_event.set()
+            if job.status == "queued":
+                # Never started: the worker will skip it
+                job.status = job.stage = "cancelled"
+                job.finished_at = time.time()
+        if job.status == "cancelled":
+            self._remove_storage(job)
+        return job
+
+    def retry(self, job_id: str) -> Optional[IngestJob]:
+        """Re-queues a failed job. Returns None if the job is unknown."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job._lock:
+            if job.status != "failed":
+                raise ValueError(f"Only failed jobs can be retried (job is {job.status})")
+            if not os.path.exists(job.storage_path):
+                raise ValueError("The upload for this job is no longer available")
+            job.status = job.stage = "queued"
+            job.cancel_event.clear()
+        self._schedule(job)
+        return job
+
+    def shutdown(self):
+        for job in self.list():
+            job.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        shutdown_parse_pool()
+
+ingest_jobs = IngestJobManager(settings.INGEST_WORKERS)
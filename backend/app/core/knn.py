@@ -0,0 +1,262 @@
+
+import threading
+from typing import List
+
+import numpy as np
+
+from app.core.chroma import get_collection
+from app.core.config import settings
+from app.core.corpus import get_corpus_version
+from app.core.ingestion import centroid_blob
+from app.core.log import get_logger, log_event
+from app.db.db import connection, transaction
+
+logger = get_logger("knn")
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+def top_k(sims: np.ndarray, idx: np.ndarray, k: int):
+    """
+    Keeps the k highest similarities of every row.
+
+    Args:
+        sims: (rows, candidates) similarities, -inf for padding
+        idx: (rows, candidates) neighbour indices matching sims
+
+    Returns:
+        tuple: (sims, idx), each (rows, k), best first
+    """
+    if sims.shape[1] > k:
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        sims = np.take_along_axis(sims, part, axis=1)
+        idx = np.take_along_axis(idx, part, axis=1)
+    order = np.argsort(-sims, axis=1)
+    return np.take_along_axis(sims, order, axis=1), np.take_along_axis(idx, order, axis=1)
+
+class KnnGraph:
+    """
+    Cosine k-nearest-neighbour graph over every chunk in the collection.
+
+    Neighbours are found with blocked matrix products (GRAPH_KNN_BLOCK_SIZE
+    rows at a time), so memory stays at block x N similarities however large
+    the collection is. The graph is cached and, when the corpus version
+    moves on, brought up to date incrementally: removed chunks are dropped,
+    only rows that lost a neighbour are recomputed, and added chunks are
+    compared against everything once.
+    """
+
+    def __init__(self, max_k: int, block_size: int):
+        self.max_k = max_k
+        self.block_size = block_size
+        self.ids: List[str] = []
+        self.filenames: List[str] = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.neighbor_sims = np.zeros((0, max_k), dtype=np.float32)
+        self.neighbor_idx = np.zeros((0, max_k), dtype=np.int64)
+        self._row_of = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _empty_neighbors(self, rows: int):
+        return np.full((rows, self.max_k), -np.inf, dtype=np.float32), np.full((rows, self.max_k), -1, dtype=np.int64)
+
+    def _search(self, rows: np.ndarray, columns: np.ndarray):
+        """
+        Best max_k neighbours of `rows` among `columns` (indices into
+        self.vectors), excluding each row itself.
+        """
+        sims_out, idx_out = self._empty_neighbors(len(rows))
+        if len(rows) == 0 or len(columns) == 0:
+            return sims_out, idx_out
+
+        column_vectors = self.vectors[columns]
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start:start + self.block_size]
+            sims = self.vectors[block] @ column_vectors.T
+            sims[block[:, None] == columns[None, :]] = -np.inf
+            idx = np.broadcast_to(columns, sims.shape)
+            # Pad so rows always come back with max_k columns
+            sims = np.concatenate([sims, sims_out[start:start + len(block)]], axis=1)
+            idx = np.concatenate([idx, idx_out[start:start + len(block)]], axis=1)
+            sims_out[start:start + len(block)], idx_out[start:start + len(block)] = top_k(sims, idx, self.max_k)
+        return sims_out, idx_out
+
+    def _remove(self, removed: set):
+        keep = np.array([chunk_id not in removed for chunk_id in self.ids], dtype=bool)
+        remap = np.full(len(self.ids), -1, dtype=np.int64)
+        remap[keep] = np.arange(int(keep.sum()))
+
+        self.ids = [chunk_id for chunk_id, k in zip(self.ids, keep) if k]
+        self.filenames = [filename for filename, k in zip(self.filenames, keep) if k]
+        self.vectors = self.vectors[keep]
+        sims = self.neighbor_sims[keep]
+        idx = self.neighbor_idx[keep]
+
+        valid = idx >= 0
+        idx = np.where(valid, remap[np.where(valid, idx, 0)], -1)
+        # Rows that lost a neighbour are searched again from scratch
+        affected = np.nonzero(((idx < 0) & valid).any(axis=1))[0]
+        self.neighbor_sims, self.neighbor_idx = sims, idx
+        if len(affected):
+            everything = np.arange(len(self.ids))
+            self.neighbor_sims[affected], self.neighbor_idx[affected] = self._search(affected, everything)
+
+    def _add(self, ids: list, filenames: list, vectors: np.ndarray):
+        old_count = len(self.ids)
+        self.ids = self.ids + ids
+        self.filenames = self.filenames + filenames
+        vectors = normalize_rows(vectors)
+        self.vectors = vectors if old_count == 0 else np.concatenate([self.vectors, vectors])
+
+        old_rows = np.arange(old_count)
+        new_rows = np.arange(old_count, len(self.ids))
+        everything = np.arange(len(self.ids))
+
+        # Existing rows only need comparing against the new chunks
+        if old_count:
+            sims, idx = self._search(old_rows, new_rows)
+            self.neighbor_sims, self.neighbor_idx = top_k(
+                np.concatenate([self.neighbor_sims, sims], axis=1),
+                np.concatenate([self.neighbor_idx, idx], axis=1),
+                self.max_k,
+            )
+        sims, idx = self._search(new_rows, everything)
+        self.neighbor_sims = np.concatenate([self.neighbor_sims, sims])
+        self.neighbor_idx = np.concatenate([self.neighbor_idx, idx])
+
+    def sync(self, collection=None):
+        """Brings the graph up to date with the collection if the corpus changed."""
+        version = get_corpus_version()
+        with self._lock:
+            if version == self._version:
+                return
+            collection = collection or get_collection()
+            current = collection.get(include=[])["ids"]
+            current_set = set(current)
+
+            removed = set(self.ids) - current_set
+            if removed:
+                self._remove(removed)
+
+            known = set(self.ids)
+            added = [chunk_id for chunk_id in current if chunk_id not in known]
+            for start in range(0, len(added), self.block_size):
+                data = collection.get(ids=added[start:start + self.block_size], include=["embeddings", "metadatas"])
+                if not data["ids"]:
+                    continue
+                self._add(
+                    data["ids"],
+                    [(metadata or {}).get("filename") for metadata in data["metadatas"]],
+                    np.asarray(data["embeddings"], dtype=np.float32),
+                )
+            self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+            self._version = version
+            log_event(logger, "knn_graph_synced", chunks=len(self.ids), added=len(added), removed=len(removed))
+
+    def load(self, ids: list, filenames: list, vectors: np.ndarray):
+        """Replaces the graph with the given vectors."""
+        with self._lock:
+            self.ids, self.filenames = [], []
+            self.neighbor_sims, self.neighbor_idx = self._empty_neighbors(0)
+            if ids:
+                self._add(list(ids), list(filenames), vectors)
+            self._row_of = {node_id: row for row, node_id in enumerate(self.ids)}
+
+    def neighbors(self, ids: list, k: int, threshold: float) -> list:
+        """
+        Outgoing edges of the given nodes.
+
+        Returns:
+            list: (source id, target id, target filename, similarity)
+        """
+        k = max(0, min(k, self.max_k))
+        edges = []
+        with self._lock:
+            for node_id in ids:
+                row = self._row_of.get(node_id)
+                if row is None:
+                    continue
+                for sim, target in zip(self.neighbor_sims[row, :k].tolist(), self.neighbor_idx[row, :k].tolist()):
+                    if target >= 0 and sim >= threshold:
+                        edges.append((node_id, self.ids[target], self.filenames[target], sim))
+        return edges
+
+    def links(self, k: int, threshold: float) -> list:
+        """
+        Undirected edges between each chunk and its k nearest neighbours
+        with cosine similarity >= threshold.
+
+        Returns:
+            list: (source id, target id, similarity), one entry per pair
+        """
+        k = max(0, min(k, self.max_k))
+        with self._lock:
+            sims = self.neighbor_sims[:, :k]
+            idx = self.neighbor_idx[:, :k]
+            rows, cols = np.nonzero((idx >= 0) & (sims >= threshold))
+            edges = {}
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                target = int(idx[row, col])
+                pair = (min(row, target), max(row, target))
+                if pair not in edges:
+                    edges[pair] = float(sims[row, col])
+            return [(self.ids[a], self.ids[b], sim) for (a, b), sim in edges.items()]
+
+    def nodes(self) -> list:
+        with self._lock:
+            return list(zip(self.ids, self.filenames))
+
+class DocumentGraph:
+    """
+    Document-level overview: one node per file, linked by the kNN graph of
+    per-file centroid vectors stored in the documents table at ingest. It
+    only reads the documents table, so its cost follows the number of
+    files, not chunks. Rebuilt when the corpus version changes.
+    """
+
+    def __init__(self, max_k: int, block_size: int):
+        self.graph = KnnGraph(max_k, block_size)
+        self.chunk_counts = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _backfill_centroid(filename: str):
+        # Documents ingested before centroids were recorded
+        data = get_collection().get(where={"filename": filename}, include=["embeddings"])
+        if not data["ids"]:
+            return None
+        blob = centroid_blob(data["embeddings"])
+        with transaction() as conn:
+            conn.execute("UPDATE documents SET centroid = ? WHERE filename = ?", (blob, filename))
+        return blob
+
+    def sync(self):
+        version = get_corpus_version()
+        with self._lock:
+            if version == self._version:
+                return
+            with connection() as conn:
+                rows = conn.execute("SELECT filename, chunk_count, centroid FROM documents ORDER BY filename").fetchall()
+            filenames, vectors, counts = [], [], {}
+            for row in rows:
+                blob = row["centroid"] or self._backfill_centroid(row["filename"])
+                if blob is None or row["filename"] in counts:
+                    continue
+                filenames.append(row["filename"])
+                vectors.append(np.frombuffer(blob, dtype=np.float32))
+                counts[row["filename"]] = row["chunk_count"] or 0
+
+            self.graph.load(filenames, filenames, np.stack(vectors) if vectors else None)
+            self.chunk_counts = counts
+            self._version = version
+
+    def documents(self) -> list:
+        """(filename, chunk_count), ordered by filename."""
+        with self._lock:
+            return list(self.chunk_counts.items())
+
+knn_graph = KnnGraph(max_k=settings.GRAPH_KNN_MAX_K, block_size=settings.GRAPH_KNN_BLOCK_SIZE)
+document_graph = DocumentGraph(max_k=settings.GRAPH_KNN_MAX_K, block_size=settings.GRAPH_KNN_BLOCK_SIZE)
@@ -0,0 +1,116 @@
+
+import re
+from langchain_core.documents import Document
+from app.core.chroma import get_collection
+from app.core.log import get_logger, log_event
+from app.db.db import connection, transaction
+
+logger = get_logger("lexical")
+
+# Keyword index over chunk text, maintained next to Chroma by the ingest and
+# delete paths. Tables are created in init_db (lexical_chunks / lexical_fts).
+
+# Common words that would match nearly every chunk
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i",
+    "in", "is", "it", "me", "my", "of", "on", "or", "the", "this", "that", "to", "was", "what",
+    "when", "where", "which", "who", "why", "with", "you", "your",
+}
+
+def index_chunks(rows):
+    """
+    Adds chunks to the keyword index.
+
+    Args:
+        rows: iterable of (chunk_id, filename, content). Chunk ids are
+            content hashes, so ids already indexed are left as they are.
+    """
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO lexical_chunks (chunk_id, filename, content) VALUES (?, ?, ?)",
+            rows,
+        )
+
+def delete_chunks(chunk_ids):
+    chunk_ids = list(chunk_ids)
+    with transaction() as conn:
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            conn.execute(f"DELETE FROM lexical_chunks WHERE chunk_id IN ({','.join('?' * len(batch))})", batch)
+
+def delete_filename(filename: str):
+    with transaction() as conn:
+        conn.execute("DELETE FROM lexical_chunks WHERE filename = ?", (filename,))
+
+def clear_index():
+    with transaction() as conn:
+        conn.execute("DELETE FROM lexical_chunks")
+
+def indexed_count() -> int:
+    with connection() as conn:
+        return conn.execute("SELECT count(*) FROM lexical_chunks").fetchone()[0]
+
+def build_match_query(question: str):
+    """
+    Turns free text into an FTS5 query: every distinct non-stopword term,
+    quoted (so punctuation can't break the syntax) and OR-ed together.
+    Returns None when nothing searchable is left.
+    """
+    terms = []
+    for term in re.findall(r"\w+", question.lower()):
+        if term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+def lexical_search(question: str, k: int, filenames=None):
+    """
+    BM25-ranked keyword search.
+
+    Args:
+        question: free text
+        k: number of chunks
+        filenames: restrict the search to these documents; None searches everything
+
+    Returns:
+        list[Document]: best match first, with `id` set to the chunk id
+    """
+    match = build_match_query(question)
+    if match is None or (filenames is not None and not filenames):
+        return []
+
+    scope, params = "", [match]
+    if filenames is not None:
+        filenames = list(filenames)
+        scope = f"AND c.filename IN ({','.join('?' * len(filenames))})"
+        params += filenames
+    with connection() as conn:
+        rows = conn.execute(
+            f'''SELECT c.chunk_id, c.filename, c.content
+                FROM lexical_fts JOIN lexical_chunks c ON c.rowid = lexical_fts.rowid
+                WHERE lexical_fts MATCH ? {scope}
+                ORDER BY bm25(lexical_fts)
+                LIMIT ?''',
+            (*params, k),
+        ).fetchall()
+    return [Document(id=row["chunk_id"], page_content=row["content"], metadata={"filename": row["filename"]}) for row in rows]
+
+def backfill_from_collection(batch_size: int = 1000):
+    """
+    Indexes chunks that were stored in Chroma before the keyword index
+    existed. Only runs when the index is empty but the collection is not.
+    """
+    collection = get_collection()
+    total = collection.count()
+    if total == 0 or indexed_count() > 0:
+        return 0
+
+    log_event(logger, "lexical_backfill", chunks=total)
+    for offset in range(0, total, batch_size):
+        data = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        index_chunks(
+            (chunk_id, (metadata or {}).get("filename"), text)
+            for chunk_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        )
+    return total
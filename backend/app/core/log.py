@@ -0,0 +1,55 @@
+import contextvars
+import json
+import logging
+import sys
+import time
+
+from app.core.config import settings
+
+# Structured logging: every record is one JSON object with the event name,
+# its fields and, inside a chat request, the request id, so log lines from
+# one request can be grouped. Set LOG_JSON=false for plain text locally.
+
+_request_id = contextvars.ContextVar("nurag_request_id", default=None)
+
+def set_request_id(request_id: str):
+    _request_id.set(request_id)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        request_id = _request_id.get()
+        if request_id is not None:
+            entry["request_id"] = request_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        line = f"{record.levelname} {record.name}: {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+def configure_logging():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if settings.LOG_JSON else TextFormatter())
+    logger = logging.getLogger("nurag")
+    logger.handlers = [handler]
+    logger.setLevel(settings.LOG_LEVEL)
+    logger.propagate = False
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"nurag.{name}")
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, exc_info=None, **fields):
+    """Logs `event` with structured fields."""
+    logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
@@ -0,0 +1,159 @@
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import AIMessage, HumanMessage
+from app.core.config import settings
+from app.core.log import get_logger, log_event
+from app.core.ollama import get_chat_model
+from app.core.scheduler import ollama_priority
+from app.db.db import connection, transaction
+
+logger = get_logger("memory")
+
+# Conversation memory: the most recent turns that fit MEMORY_HISTORY_TOKENS
+# go to the model verbatim; everything older is folded into a rolling
+# per-thread summary (thread_summaries) in the background after a reply.
+# The summary records the last message it covers, so each update only
+# reads and compresses the turns that fell out of the window since.
+
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for budgeting."""
+    return len(text) // 4 + 1
+
+def empty_memory() -> dict:
+    return {"summary": "", "history": []}
+
+def read_summary(conn, thread_id: str):
+    row = conn.execute(
+        "SELECT summary, covered_rowid FROM thread_summaries WHERE thread_id = ?", (thread_id,)
+    ).fetchone()
+    if row is None:
+        return "", 0
+    return row["summary"], row["covered_rowid"]
+
+def unsummarized_messages(conn, thread_id: str, covered_rowid: int, limit: int):
+    """Newest first: (rowid, role, content) of messages not yet in the summary."""
+    return conn.execute(
+        """SELECT rowid, role, content FROM messages
+           WHERE thread_id = ? AND rowid > ?
+           ORDER BY created_at DESC, rowid DESC LIMIT ?""",
+        (thread_id, covered_rowid, limit),
+    ).fetchall()
+
+def fit_window(rows, budget: int) -> int:
+    """How many of the newest-first rows fit in the token budget."""
+    used = 0
+    for count, row in enumerate(rows):
+        used += estimate_tokens(row["content"])
+        if used > budget:
+            return count
+    return len(rows)
+
+def load_memory(thread_id: str) -> dict:
+    """
+    Memory for the next turn of a thread: its rolling summary and the
+    recent messages (oldest first) that fit MEMORY_HISTORY_TOKENS.
+
+    Returns:
+        dict: {"summary": str, "history": [{"role", "content"}]}
+    """
+    if not settings.MEMORY_ENABLED or not thread_id:
+        return empty_memory()
+
+    with connection() as conn:
+        summary, covered_rowid = read_summary(conn, thread_id)
+        rows = unsummarized_messages(conn, thread_id, covered_rowid, settings.MEMORY_MAX_MESSAGES)
+
+    window = rows[:fit_window(rows, settings.MEMORY_HISTORY_TOKENS)]
+    history = [{"role": row["role"], "content": row["content"]} for row in reversed(window)]
+    return {"summary": summary, "history": history}
+
+def history_messages(history: list) -> list:
+    """Converts stored history into chat messages."""
+    return [
+        AIMessage(content=turn["content"]) if turn["role"] == "assistant" else HumanMessage(content=turn["content"])
+        for turn in history
+    ]
+
+def summarize(summary: str, turns: list) -> str:
+    llm = get_chat_model(settings.MEMORY_SUMMARY_MODEL, temperature=0)
+    transcript = "\n".join(f"{row['role'].upper()}: {row['content']}" for row in turns)
+    prompt = f"""You maintain a running summary of a conversation between a user and an assistant.
+Update the summary with the new turns below. Keep names, facts, decisions and open questions the
+user may refer back to. Drop small talk. Write at most {settings.MEMORY_SUMMARY_MAX_TOKENS * 3 // 4} words,
+as plain prose, without any preamble.
+
+Current summary:
+{summary or "(empty)"}
+
+New turns:
+{transcript}
+
+Updated summary:"""
+    with ollama_priority("background"):
+        return llm.invoke([HumanMessage(content=prompt)]).content.strip()
+
+def update_summary(thread_id: str):
+    """
+    Folds the turns that no longer fit the history window into the thread
+    summary. Turns are folded oldest first, at most MEMORY_SUMMARY_BATCH_TOKENS
+    per model call, so the summarizer prompt stays bounded too.
+    """
+    while True:
+        with connection() as conn:
+            summary, covered_rowid = read_summary(conn, thread_id)
+            rows = unsummarized_messages(conn, thread_id, covered_rowid, settings.MEMORY_MAX_MESSAGES)
+            # The window load_memory would send starts at `boundary`; older turns get folded
+            kept = fit_window(rows, settings.MEMORY_HISTORY_TOKENS)
+            if kept == len(rows) and len(rows) < settings.MEMORY_MAX_MESSAGES:
+                return
+            boundary = rows[kept - 1]["rowid"] if kept else rows[0]["rowid"] + 1
+            overflow = conn.execute(
+                """SELECT rowid, role, content FROM messages
+                   WHERE thread_id = ? AND rowid > ? AND rowid < ?
+                   ORDER BY rowid LIMIT ?""",
+                (thread_id, covered_rowid, boundary, settings.MEMORY_MAX_MESSAGES),
+            ).fetchall()
+        if not overflow:
+            return
+
+        batch = overflow[:max(1, fit_window(overflow, settings.MEMORY_SUMMARY_BATCH_TOKENS))]
+        new_summary = summarize(summary, batch)
+        with transaction() as conn:
+            conn.execute(
+                """INSERT INTO thread_summaries (thread_id, summary, covered_rowid, updated_at)
+                   VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                   ON CONFLICT(thread_id) DO UPDATE SET
+                       summary = excluded.summary,
+                       covered_rowid = excluded.covered_rowid,
+                       updated_at = excluded.updated_at""",
+                (thread_id, new_summary, batch[-1]["rowid"]),
+            )
+        log_event(logger, "summary_updated", thread_id=thread_id, folded=len(batch))
+
+def _run_summary_update(thread_id: str):
+    try:
+        update_summary(thread_id)
+    except Exception as e:
+        log_event(logger, "summary_update_failed", logging.ERROR, exc_info=e, thread_id=thread_id)
+    finally:
+        with _summarizing_lock:
+            _summarizing.discard(thread_id)
+
+def schedule_summary_update(thread_id: str):
+    """Updates the thread summary in the background, once per thread at a time."""
+    if not settings.MEMORY_ENABLED:
+        return
+    with _summarizing_lock:
+        if thread_id in _summarizing:
+            return
+        _summarizing.add(thread_id)
+    _summary_executor.submit(_run_summary_update, thread_id)
+
+def delete_summary(conn, thread_id: str):
+    conn.execute("DELETE FROM thread_summaries WHERE thread_id = ?", (thread_id,))
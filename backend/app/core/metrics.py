@@ -0,0 +1,143 @@
+import contextvars
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Latency histograms for every stage of a request, exposed at /metrics.
+# `timed` records a histogram sample and, when the current request asked
+# for a trace (see start_trace), a span in that request's breakdown. The
+# trace lives in a context variable, so it follows the request into
+# asyncio tasks and the worker threads LangGraph and asyncio.to_thread use.
+
+# Tuned for local models: sub-millisecond SQLite reads up to multi-minute generations
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Histogram -> the stage name its spans carry in a request trace
+_stages = {}
+
+def stage_histogram(name: str, stage: str, documentation: str, labels) -> Histogram:
+    histogram = Histogram(name, documentation, labels, buckets=LATENCY_BUCKETS)
+    _stages[histogram] = stage
+    return histogram
+
+NODE_SECONDS = stage_histogram("nurag_graph_node_seconds", "node", "Time spent in each graph node", ["node"])
+OLLAMA_SECONDS = stage_histogram(
+    "nurag_ollama_request_seconds", "ollama",
+    "Ollama calls, from request to the last streamed byte", ["model", "endpoint"],
+)
+OLLAMA_FIRST_TOKEN_SECONDS = stage_histogram(
+    "nurag_ollama_first_token_seconds", "ollama_first_token",
+    "Time until Ollama streams its first line (prompt processing)", ["model"],
+)
+OLLAMA_ERRORS = Counter("nurag_ollama_errors_total", "Failed Ollama calls", ["model", "endpoint"])
+CHROMA_SECONDS = stage_histogram("nurag_chroma_seconds", "chroma", "Chroma collection calls", ["operation"])
+SQLITE_SECONDS = stage_histogram("nurag_sqlite_seconds", "sqlite", "SQLite work run on the database executor", ["operation"])
+INGEST_STAGE_SECONDS = stage_histogram("nurag_ingest_stage_seconds", "ingest", "Ingestion stages", ["stage"])
+OLLAMA_QUEUE_SECONDS = stage_histogram(
+    "nurag_ollama_queue_seconds", "ollama_queue",
+    "Time Ollama calls wait for a scheduler slot", ["model", "priority"],
+)
+OLLAMA_QUEUE_DEPTH = Gauge("nurag_ollama_queue_depth", "Ollama calls waiting for a slot", ["model", "priority"])
+OLLAMA_IN_FLIGHT = Gauge("nurag_ollama_in_flight", "Ollama calls holding a slot", ["model"])
+OLLAMA_REJECTED = Counter(
+    "nurag_ollama_rejected_total", "Ollama calls refused a slot", ["model", "priority", "reason"],
+)
+COALESCED = Counter(
+    "nurag_coalesced_total", "Calls that joined an identical call already in flight", ["operation"],
+)
+SPECULATIVE_RETRIEVALS = Counter(
+    "nurag_speculative_retrievals_total",
+    "Retrievals started alongside routing, by whether the route used them", ["outcome"],
+)
+SPECULATION_SAVED_SECONDS = Histogram(
+    "nurag_speculation_saved_seconds",
+    "Retrieval time hidden behind routing when a speculative retrieval is used", buckets=LATENCY_BUCKETS,
+)
+GRADE_DECISIONS = Counter(
+    "nurag_grade_decisions_total", "Chunk relevance decisions, by how they were made", ["method"],
+)
+GRADER_THRESHOLDS = Gauge("nurag_grader_similarity_threshold", "Similarity bounds of automatic grading", ["bound"])
+REQUEST_SECONDS = stage_histogram("nurag_chat_request_seconds", "request", "Chat requests end to end", ["endpoint"])
+
+_trace = contextvars.ContextVar("nurag_trace", default=None)
+
+class Trace:
+    """Spans recorded for one request, in completion order."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, stage: str, seconds: float, labels: dict):
+        self.spans.append({
+            "stage": stage,
+            **labels,
+            "start": round(time.perf_counter() - seconds - self.started, 4),
+            "seconds": round(seconds, 4),
+        })
+
+    def to_dict(self) -> dict:
+        return {"total_seconds": round(time.perf_counter() - self.started, 4), "spans": list(self.spans)}
+
+def start_trace() -> Trace:
+    """Starts collecting spans for the current request."""
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+def observe(histogram, seconds: float, **labels):
+    """Records a sample and, inside a traced request, a span."""
+    histogram.labels(**labels).observe(seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(_stages[histogram], seconds, labels)
+
+@contextmanager
+def timed(histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(histogram, time.perf_counter() - started, **labels)
+
+def instrument_node(name: str, fn):
+    """
+    Wraps a graph node or routing function so its runs land in
+    NODE_SECONDS. functools.wraps keeps the signature visible, so LangGraph
+    still passes `config` to nodes that accept it.
+    """
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def timed_node(*args, **kwargs):
+            with timed(NODE_SECONDS, node=name):
+                return await fn(*args, **kwargs)
+    else:
+        @functools.wraps(fn)
+        def timed_node(*args, **kwargs):
+            with timed(NODE_SECONDS, node=name):
+                return fn(*args, **kwargs)
+    return timed_node
+
+class TimedCollection:
+    """Proxy for a Chroma collection that times every method call."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def timed_call(*args, **kwargs):
+            with timed(CHROMA_SECONDS, operation=name):
+                return attr(*args, **kwargs)
+        return timed_call
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import httpx
+from langchain_community.chat_models import ChatOllama
+from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+from app.core.config import settings
+from app.core.log import get_logger, log_event
+from app.core.metrics import OLLAMA_ERRORS, OLLAMA_FIRST_TOKEN_SECONDS, OLLAMA_SECONDS, observe
+from app.core.scheduler import ollama_priority, ollama_scheduler
+
+logger = get_logger("ollama")
+
+# One process-wide set of HTTP clients for every Ollama call. LangChain's
+# Ollama wrappers open a fresh connection (and, on the async path, a fresh
+# aiohttp session) per request; the subclasses below send the same payloads
+# through pooled keep-alive connections instead, and pass each model's
+# keep_alive so Ollama doesn't unload it between requests. Every call holds
+# an ollama_scheduler slot while it runs.
+
+def model_timeout(model: str) -> float:
+    return settings.OLLAMA_MODEL_TIMEOUTS.get(model, settings.OLLAMA_TIMEOUT)
+
+def model_keep_alive(model: str) -> str:
+    return settings.OLLAMA_MODEL_KEEP_ALIVE.get(model, settings.OLLAMA_KEEP_ALIVE)
+
+def http_timeout(read: Optional[float]) -> httpx.Timeout:
+    return httpx.Timeout(read, connect=settings.OLLAMA_CONNECT_TIMEOUT)
+
+def endpoint_name(api_url: str) -> str:
+    return api_url.rstrip("/").rsplit("/", 1)[-1]
+
+def check_response(response, model: str, body: str):
+    if response.status_code != 200:
+        OLLAMA_ERRORS.labels(model=model, endpoint=endpoint_name(str(response.url))).inc()
+    if response.status_code == 404:
+        raise OllamaEndpointNotFoundError(
+            "Ollama call failed with status code 404. "
+            f"Maybe your model is not found and you should pull the model with `ollama pull {model}`."
+        )
+    if response.status_code != 200:
+        raise ValueError(f"Ollama call failed with status code {response.status_code}. Details: {body}")
+
+class PooledChatOllama(ChatOllama):
+    """ChatOllama whose requests go through the shared connection pools."""
+
+    def _request_payload(self, payload: Any, stop: Optional[List[str]], **kwargs: Any) -> dict:
+        # Same request body ChatOllama builds before posting it
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+
+        if payload.get("messages"):
+            return {"messages": payload.get("messages", []), **params}
+        return {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+    def _headers(self) -> dict:
+        return {"Content-Type": "application/json", **(self.headers if isinstance(self.headers, dict) else {})}
+
+    def _create_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None, **kwargs: Any) -> Iterator[str]:
+        request_payload = self._request_payload(payload, stop, **kwargs)
+        client = ollama_clients.http()
+        with ollama_scheduler.slot(self.model):
+            started, first_line = time.perf_counter(), True
+            try:
+                with client.stream(
+                    "POST", api_url, headers=self._headers(), auth=self.auth,
+                    json=request_payload, timeout=http_timeout(self.timeout),
+                ) as response:
+                    if response.status_code != 200:
+                        check_response(response, self.model, response.read().decode("utf-8", "replace"))
+                    for line in response.iter_lines():
+                        if first_line:
+                            observe(OLLAMA_FIRST_TOKEN_SECONDS, time.perf_counter() - started, model=self.model)
+                            first_line = False
+                        yield line
+            finally:
+                observe(OLLAMA_SECONDS, time.perf_counter() - started, model=self.model, endpoint=endpoint_name(api_url))
+
+    async def _acreate_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None, **kwargs: Any) -> AsyncIterator[str]:
+        request_payload = self._request_payload(payload, stop, **kwargs)
+        client = ollama_clients.async_http()
+        async with ollama_scheduler.aslot(self.model):
+            started, first_line = time.perf_counter(), True
+            try:
+                async with client.stream(
+                    "POST", api_url, headers=self._headers(), auth=self.auth,
+                    json=request_payload, timeout=http_timeout(self.timeout),
+                ) as response:
+                    if response.status_code != 200:
+                        check_response(response, self.model, (await response.aread()).decode("utf-8", "replace"))
+                    async for line in response.aiter_lines():
+                        if first_line:
+                            observe(OLLAMA_FIRST_TOKEN_SECONDS, time.perf_counter() - started, model=self.model)
+                            first_line = False
+                        yield line
+            finally:
+                observe(OLLAMA_SECONDS, time.perf_counter() - started, model=self.model, endpoint=endpoint_name(api_url))
+
+class PooledOllamaEmbeddings(OllamaEmbeddings):
+    """
+    OllamaEmbeddings whose requests go through the shared connection pool.
+
+    LangChain sends one /api/embeddings request per text. With `batch`, each
+    call sends all its texts as one /api/embed request instead. That
+    endpoint returns unit-length vectors, so the two modes' vectors must
+    not be mixed in one collection.
+    """
+
+    keep_alive: Optional[str] = None
+    timeout: Optional[float] = None
+    batch: bool = False
+
+    def _post(self, endpoint: str, body: dict) -> dict:
+        with ollama_scheduler.slot(self.model):
+            started = time.perf_counter()
+            try:
+                res = ollama_clients.http().post(
+                    f"{self.base_url}/api/{endpoint}",
+                    headers={"Content-Type": "application/json", **(self.headers or {})},
+                    json={**body, "keep_alive": self.keep_alive, **self._default_params},
+                    timeout=http_timeout(self.timeout),
+                )
+            except httpx.HTTPError as e:
+                OLLAMA_ERRORS.labels(model=self.model, endpoint=endpoint).inc()
+                raise ValueError(f"Error raised by inference endpoint: {e}")
+            finally:
+                observe(OLLAMA_SECONDS, time.perf_counter() - started, model=self.model, endpoint=endpoint)
+
+        if res.status_code != 200:
+            OLLAMA_ERRORS.labels(model=self.model, endpoint=endpoint).inc()
+            raise ValueError(f"Error raised by inference API HTTP code: {res.status_code}, {res.text}")
+        try:
+            return res.json()
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Error raised by inference API: {e}.\nResponse: {res.text}")
+
+    def _process_emb_response(self, input: str) -> List[float]:
+        data = self._post("embeddings", {"prompt": input})
+        try:
+            return data["embedding"]
+        except KeyError as e:
+            raise ValueError(f"Error raised by inference API: missing {e}.\nResponse: {data}")
+
+    def _embed(self, input: List[str]) -> List[List[float]]:
+        if not self.batch:
+            return super()._embed(input)
+        if not input:
+            return []
+        data = self._post("embed", {"input": input})
+        vectors = data.get("embeddings")
+        if not isinstance(vectors, list) or len(vectors) != len(input):
+            raise ValueError(f"Error raised by inference API: expected {len(input)} embeddings.\nResponse: {data}")
+        return vectors
+
+class OllamaClients:
+    """
+    Process-wide Ollama client registry: pooled HTTP clients plus one
+    model wrapper per (model, temperature, format), created on first use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._http = None
+        self._async_http = None
+        self._async_loop = None
+        self._chat_models = {}
+        self._embeddings = {}
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OLLAMA_MAX_CONNECTIONS,
+        )
+
+    def http(self) -> httpx.Client:
+        """Shared synchronous client (thread-safe), used from worker threads."""
+        with self._lock:
+            if self._http is None:
+                self._http = httpx.Client(limits=self.limits(), timeout=http_timeout(settings.OLLAMA_TIMEOUT))
+            return self._http
+
+    def async_http(self) -> httpx.AsyncClient:
+        """Shared asynchronous client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # A client is tied to the loop it was first used on
+            if self._async_http is None or self._async_loop is not loop:
+                self._async_http = httpx.AsyncClient(limits=self.limits(), timeout=http_timeout(settings.OLLAMA_TIMEOUT))
+                self._async_loop = loop
+            return self._async_http
+
+    def chat_model(self, model: str, temperature: float = 0, format: Optional[str] = None) -> PooledChatOllama:
+        key = (model, temperature, format)
+        with self._lock:
+            llm = self._chat_models.get(key)
+            if llm is None:
+                llm = PooledChatOllama(
+                    model=model,
+                    base_url=settings.OLLAMA_BASE_URL,
+                    temperature=temperature,
+                    format=format,
+                    keep_alive=model_keep_alive(model),
+                    timeout=model_timeout(model),
+                )
+                self._chat_models[key] = llm
+            return llm
+
+    def embeddings(self, model: str) -> PooledOllamaEmbeddings:
+        with self._lock:
+            emb = self._embeddings.get(model)
+            if emb is None:
+                emb = PooledOllamaEmbeddings(
+                    model=model,
+                    base_url=settings.OLLAMA_BASE_URL,
+                    keep_alive=model_keep_alive(model),
+                    timeout=model_timeout(model),
+                    batch=settings.OLLAMA_BATCH_EMBED,
+                )
+                self._embeddings[model] = emb
+            return emb
+
+    def load_model(self, model: str, embedding: bool = False):
+        """
+        Asks Ollama to load a model into memory and keep it for its keep_alive.
+        A generate request without a prompt only loads the model; embedding
+        models are loaded by embedding a single word.
+        """
+        if embedding:
+            path, body = "/api/embeddings", {"model": model, "prompt": "warm-up"}
+        else:
+            path, body = "/api/generate", {"model": model, "stream": False}
+        with ollama_scheduler.slot(model):
+            started = time.perf_counter()
+            try:
+                response = self.http().post(
+                    f"{settings.OLLAMA_BASE_URL}{path}",
+                    json={**body, "keep_alive": model_keep_alive(model)},
+                    timeout=http_timeout(model_timeout(model)),
+                )
+            finally:
+                observe(OLLAMA_SECONDS, time.perf_counter() - started, model=model, endpoint="load")
+        check_response(response, model, response.text)
+
+    def warm_up(self, chat_models: List[str], embedding_models: List[str]):
+        """Loads each model in turn; failures are logged, never raised."""
+        for model, embedding in [(m, False) for m in dict.fromkeys(chat_models)] + [(m, True) for m in dict.fromkeys(embedding_models)]:
+            start = time.perf_counter()
+            try:
+                with ollama_priority("background"):
+                    self.load_model(model, embedding)
+                log_event(logger, "model_warmed_up", model=model, seconds=round(time.perf_counter() - start, 3))
+            except Exception as e:
+                log_event(logger, "model_warm_up_failed", logging.ERROR, model=model, error=str(e))
+
+    async def aclose(self):
+        with self._lock:
+            http, async_http = self._http, self._async_http
+            self._http = self._async_http = self._async_loop = None
+        if http is not None:
+            http.close()
+        if async_http is not None:
+            try:
+                await async_http.aclose()
+            except RuntimeError as e:
+                # Opened on an event loop that has since closed
+                log_event(logger, "ollama_client_close_failed", logging.WARNING, error=str(e))
+
+ollama_clients = OllamaClients()
+
+def get_chat_model(model: str, temperature: float = 0, format: Optional[str] = None) -> PooledChatOllama:
+    return ollama_clients.chat_model(model, temperature, format)
@@ -0,0 +1,52 @@
+
+import os
+import time
+from langchain_community.document_loaders import TextLoader, PyPDFLoader, BSHTMLLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Kept free of Chroma/DB imports: this module is loaded by parser worker processes
+
+TEXT_EXTENSIONS = [".txt", ".md", ".py", ".js", ".ts", ".java", ".c", ".cpp", ".h", ".hpp", ".cs", ".go", ".rs", ".rb", ".php", ".swift", ".kt", ".json", ".yaml", ".yml", ".sh", ".bat", ".ps1", ".css", ".sql", ".xml"]
+SUPPORTED_EXTENSIONS = [".pdf", ".html", ".htm"] + TEXT_EXTENSIONS
+
+def is_supported(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS
+
+def get_loader(file_path: str, filename: str):
+    ext = os.path.splitext(filename)[1].lower()
+    
+    if ext == ".pdf":
+        return PyPDFLoader(file_path)
+    elif ext in [".html", ".htm"]:
+        return BSHTMLLoader(file_path)
+    elif ext in TEXT_EXTENSIONS:
+        return TextLoader(file_path, autodetect_encoding=True)
+    raise ValueError(f"Unsupported file type: {ext}. Supported: PDF, HTML, Code, Text, MD.")
+
+def load_and_split(file_path: str, filename: str, chunk_size: int, chunk_overlap: int):
+    """
+    Parses a file and splits it into chunks tagged with their filename.
+    """
+    docs = get_loader(file_path, filename).load()
+    
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    doc_splits = text_splitter.split_documents(docs)
+    
+    # Add filename metadata for deletion
+    for doc in doc_splits:
+        doc.metadata["filename"] = filename
+    return doc_splits
+
+def timed_load_and_split(file_path: str, filename: str, chunk_size: int, chunk_overlap: int):
+    """
+    load_and_split, also returning how long it took in the worker process,
+    where the parent's metrics can't see it.
+
+    Returns:
+        tuple: (doc_splits, seconds)
+    """
+    started = time.perf_counter()
+    doc_splits = load_and_split(file_path, filename, chunk_size, chunk_overlap)
+    return doc_splits, time.perf_counter() - started
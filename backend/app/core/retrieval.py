@@ -0,0 +1,134 @@
+
+import asyncio
+import numpy as np
+from langchain_core.documents import Document
+from app.core.chroma import get_collection
+from app.core.config import settings
+from app.core.corpus import get_corpus_version
+from app.core.embeddings import get_embedding_model
+from app.core.lexical import lexical_search
+from app.core.log import get_logger, log_event
+from app.core.metrics import SQLITE_SECONDS, timed
+from app.core.singleflight import FlightGroup
+
+logger = get_logger("retrieval")
+
+retrieval_flights = FlightGroup("retrieval")
+
+def cosine_similarities(query, vectors) -> list:
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(-1, len(query))
+    query = np.asarray(query, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    return (matrix @ query / np.where(norms == 0, 1.0, norms)).tolist()
+
+def scope_filter(filenames):
+    """Chroma `where` clause restricting a query to the given documents (None: whole collection)."""
+    if filenames is None:
+        return None
+    return {"filename": {"$in": list(filenames)}}
+
+def scope_key(filenames):
+    """Hashable form of a document scope, for cache and coalescing keys."""
+    return None if filenames is None else tuple(sorted(set(filenames)))
+
+def vector_search(question: str, k: int, filenames=None):
+    """
+    Nearest-neighbour search in Chroma using the cached embedding model.
+
+    Args:
+        question: text to search for
+        k: number of chunks
+        filenames: restrict the search to these documents; None searches everything
+
+    Returns:
+        tuple: (list[Document] closest first, with `id` set to the chunk id;
+        {chunk id: cosine similarity to the question})
+    """
+    if filenames is not None and not filenames:
+        return [], {}
+    collection = get_collection()
+    query = get_embedding_model().embed_query(question)
+    result = collection.query(
+        query_embeddings=[query], n_results=k, where=scope_filter(filenames),
+        include=["documents", "metadatas", "embeddings"],
+    )
+    documents = [
+        Document(id=chunk_id, page_content=text, metadata=metadata or {})
+        for chunk_id, text, metadata in zip(result["ids"][0], result["documents"][0], result["metadatas"][0])
+    ]
+    return documents, dict(zip(result["ids"][0], cosine_similarities(query, result["embeddings"][0])))
+
+def chunk_similarities(question: str, chunk_ids: list) -> dict:
+    """Cosine similarity of the question to stored chunks, e.g. keyword-only hits."""
+    query = get_embedding_model().embed_query(question)
+    result = get_collection().get(ids=chunk_ids, include=["embeddings"])
+    return dict(zip(result["ids"], cosine_similarities(query, result["embeddings"])))
+
+def timed_lexical_search(question: str, k: int, filenames=None):
+    with timed(SQLITE_SECONDS, operation="lexical_search"):
+        return lexical_search(question, k, filenames)
+
+def reciprocal_rank_fusion(ranked_lists, weights, k: int):
+    """
+    Merges ranked result lists: each document scores sum(weight / (k + rank))
+    over the lists it appears in. The first occurrence of a document is the
+    one kept, so list order decides whose metadata wins.
+
+    Returns:
+        list[Document]: best fused score first
+    """
+    scores = {}
+    documents = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, doc in enumerate(ranked, start=1):
+            scores[doc.id] = scores.get(doc.id, 0.0) + weight / (k + rank)
+            documents.setdefault(doc.id, doc)
+    return [documents[doc_id] for doc_id in sorted(scores, key=scores.get, reverse=True)]
+
+async def fused_search(question: str, filenames=None):
+    """
+    Runs vector and keyword search concurrently and fuses them with RRF,
+    keeping the top RETRIEVAL_K chunks. Both searches are restricted to
+    `filenames` when given.
+
+    Returns:
+        tuple: (documents, {chunk id: cosine similarity to the question})
+    """
+    if not settings.HYBRID_RETRIEVAL:
+        return await asyncio.to_thread(vector_search, question, settings.RETRIEVAL_K, filenames)
+
+    (vector_hits, similarities), lexical_hits = await asyncio.gather(
+        asyncio.to_thread(vector_search, question, settings.RETRIEVAL_VECTOR_K, filenames),
+        asyncio.to_thread(timed_lexical_search, question, settings.RETRIEVAL_LEXICAL_K, filenames),
+    )
+    fused = reciprocal_rank_fusion(
+        [vector_hits, lexical_hits],
+        [settings.RRF_VECTOR_WEIGHT, settings.RRF_LEXICAL_WEIGHT],
+        settings.RRF_K,
+    )
+    fused = fused[:settings.RETRIEVAL_K]
+    log_event(logger, "hybrid_search", vector=len(vector_hits), lexical=len(lexical_hits), fused=len(fused))
+    
+    # Keyword-only hits get their similarity from the stored embeddings
+    missing = [d.id for d in fused if d.id not in similarities]
+    if missing:
+        similarities = {**similarities, **await asyncio.to_thread(chunk_similarities, question, missing)}
+    return fused, {d.id: similarities[d.id] for d in fused if d.id in similarities}
+
+async def hybrid_search(question: str, filenames=None):
+    """
+    Retrieves chunks for a question. Identical concurrent questions with the
+    same document scope against the same corpus version share one search.
+
+    Args:
+        question: text to search for
+        filenames: restrict retrieval to these documents; None searches everything
+
+    Returns:
+        tuple: (documents, {chunk id: cosine similarity to the question})
+    """
+    if not settings.COALESCE_RETRIEVAL:
+        return await fused_search(question, filenames)
+    return await retrieval_flights.do(
+        (question, scope_key(filenames), get_corpus_version()), lambda: fused_search(question, filenames)
+    )
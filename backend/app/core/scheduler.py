@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from app.core.config import settings
+from app.core.log import get_logger, log_event
+from app.core.metrics import OLLAMA_IN_FLIGHT, OLLAMA_QUEUE_DEPTH, OLLAMA_QUEUE_SECONDS, OLLAMA_REJECTED, observe
+
+logger = get_logger("scheduler")
+
+# Every Ollama call takes a slot from the scheduler before it is sent, so
+# one local Ollama instance sees at most OLLAMA_MAX_CONCURRENCY calls, and
+# each model at most its own cap. Calls that find no free slot queue and are
+# granted slots best priority class first, then in arrival order; waiting
+# calls move up one class every OLLAMA_PRIORITY_AGING seconds so background
+# work still progresses under steady chat load.
+#
+# The class comes from the caller's context (see ollama_priority). Interactive
+# classes have a bounded queue and wait at most OLLAMA_QUEUE_TIMEOUT, then
+# fail with OllamaBusyError (429 at the API); background calls wait as long
+# as it takes.
+
+PRIORITIES = {"chat": 0, "grading": 1, "routing": 2, "background": 3}
+BACKGROUND = "background"
+
+_priority = contextvars.ContextVar("nurag_ollama_priority", default="chat")
+
+@contextmanager
+def ollama_priority(name: str):
+    """Runs the Ollama calls made inside the block in priority class `name`."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority class: {name}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority() -> str:
+    return _priority.get()
+
+class OllamaBusyError(Exception):
+    """An Ollama call could not get a slot: its queue was full or the wait timed out."""
+
+class _Waiter:
+    def __init__(self, model: str, priority: str, seq: int, wake):
+        self.model = model
+        self.priority = priority
+        self.seq = seq
+        self.wake = wake
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class OllamaScheduler:
+    """Concurrency slots for Ollama calls, shared by threads and event loops."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}  # model -> calls holding a slot
+        self._total = 0
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def model_limit(self, model: str) -> int:
+        return settings.OLLAMA_MODEL_CONCURRENCY_OVERRIDES.get(model, settings.OLLAMA_MODEL_CONCURRENCY)
+
+    def _fits(self, model: str) -> bool:
+        return self._total < settings.OLLAMA_MAX_CONCURRENCY and self._active.get(model, 0) < self.model_limit(model)
+
+    def _take(self, model: str):
+        self._total += 1
+        self._active[model] = self._active.get(model, 0) + 1
+        OLLAMA_IN_FLIGHT.labels(model=model).inc()
+
+    def _rank(self, waiter: _Waiter, now: float):
+        rank = PRIORITIES[waiter.priority]
+        if settings.OLLAMA_PRIORITY_AGING > 0:
+            rank -= int((now - waiter.enqueued) / settings.OLLAMA_PRIORITY_AGING)
+        return rank, waiter.seq
+
+    def _dispatch(self):
+        """Grants free slots to the best-ranked waiters. Call with the lock held."""
+        now = time.monotonic()
+        for waiter in sorted(self._waiting, key=lambda w: self._rank(w, now)):
+            if self._total >= settings.OLLAMA_MAX_CONCURRENCY:
+                break
+            if self._fits(waiter.model):
+                self._waiting.remove(waiter)
+                OLLAMA_QUEUE_DEPTH.labels(model=waiter.model, priority=waiter.priority).dec()
+                self._take(waiter.model)
+                waiter.granted = True
+                waiter.wake()
+
+    def _reject(self, model: str, priority: str, reason: str):
+        OLLAMA_REJECTED.labels(model=model, priority=priority, reason=reason).inc()
+        log_event(logger, "ollama_call_rejected", logging.WARNING, model=model, priority=priority, reason=reason)
+        raise OllamaBusyError(f"Ollama is busy ({reason} for {model}), try again shortly")
+
+    def _enqueue(self, model: str, priority: str, wake) -> Optional[_Waiter]:
+        """Takes a free slot (returns None) or queues a waiter to be woken with one."""
+        with self._lock:
+            # Waiters only exist while their model or the instance is full,
+            # so a call that fits now isn't overtaking anyone
+            if self._fits(model):
+                self._take(model)
+                return None
+            if priority != BACKGROUND:
+                queued = sum(1 for w in self._waiting if w.model == model and w.priority != BACKGROUND)
+                if queued >= settings.OLLAMA_QUEUE_MAX:
+                    self._reject(model, priority, "queue_full")
+            waiter = _Waiter(model, priority, next(self._seq), wake)
+            self._waiting.append(waiter)
+            OLLAMA_QUEUE_DEPTH.labels(model=model, priority=priority).inc()
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Withdraws a waiter. Returns True if it was granted a slot meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiting.remove(waiter)
+            OLLAMA_QUEUE_DEPTH.labels(model=waiter.model, priority=waiter.priority).dec()
+            return False
+
+    def _timeout(self, priority: str) -> Optional[float]:
+        return None if priority == BACKGROUND else settings.OLLAMA_QUEUE_TIMEOUT
+
+    def acquire(self, model: str):
+        """Blocks until the current thread may call `model`."""
+        priority = current_priority()
+        started = time.perf_counter()
+        event = threading.Event()
+        waiter = self._enqueue(model, priority, event.set)
+        if waiter is not None and not event.wait(self._timeout(priority)):
+            if not self._abandon(waiter):
+                self._reject(model, priority, "timeout")
+        observe(OLLAMA_QUEUE_SECONDS, time.perf_counter() - started, model=model, priority=priority)
+
+    async def acquire_async(self, model: str):
+        """Waits, without blocking the event loop, until the caller may call `model`."""
+        priority = current_priority()
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self._enqueue(model, priority, lambda: loop.call_soon_threadsafe(_resolve, future))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(future, self._timeout(priority))
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    self._reject(model, priority, "timeout")
+            except asyncio.CancelledError:
+                if self._abandon(waiter):
+                    self.release(model)
+                raise
+        observe(OLLAMA_QUEUE_SECONDS, time.perf_counter() - started, model=model, priority=priority)
+
+    def release(self, model: str):
+        with self._lock:
+            self._total -= 1
+            self._active[model] -= 1
+            OLLAMA_IN_FLIGHT.labels(model=model).dec()
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, model: str):
+        self.acquire(model)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    @asynccontextmanager
+    async def aslot(self, model: str):
+        await self.acquire_async(model)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+ollama_scheduler = OllamaScheduler()
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+
+from app.core.metrics import COALESCED
+
+# Request coalescing ("single flight"): concurrent calls with the same key
+# share one execution instead of each doing the same work. FlightGroup is
+# for coroutines and also lets joiners replay and follow the events a run
+# publishes (used to stream one graph run to several clients); CallGroup is
+# the blocking equivalent for worker threads.
+
+class Flight:
+    """One shared run: the events it has published so far and its outcome."""
+
+    def __init__(self, key):
+        self.key = key
+        self.events = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.subscribers = 1
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str, data: dict):
+        self.events.append((event, data))
+        self._notify()
+
+    def finish(self, result=None, error: BaseException = None):
+        self.done, self.result, self.error = True, result, error
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        """
+        Yields every (event, data) published so far, then new ones as they
+        arrive, until the run ends. Raises the run's error, if it failed.
+        """
+        seen = 0
+        while True:
+            while seen < len(self.events):
+                yield self.events[seen]
+                seen += 1
+            if self.done:
+                break
+            await self._changed.wait()
+        if self.error is not None:
+            raise self.error
+
+    async def wait(self):
+        """Returns the run's result once it finishes."""
+        async for _ in self.follow():
+            pass
+        return self.result
+
+class FlightGroup:
+    """Concurrent runs with the same key on one event loop share a Flight."""
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self._flights = {}
+
+    def join(self, key, run) -> Flight:
+        """
+        Joins the in-flight run for `key`, or starts `run(flight)` (a
+        coroutine function) as a new one. Every join needs a matching leave.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.subscribers += 1
+            COALESCED.labels(operation=self.operation).inc()
+            return flight
+        flight = Flight(key)
+        self._flights[key] = flight
+        flight.task = asyncio.ensure_future(self._execute(flight, run))
+        return flight
+
+    def leave(self, flight: Flight):
+        """Drops a subscriber; a run nobody is waiting for is cancelled."""
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done:
+            self._forget(flight)
+            flight.task.cancel()
+
+    def _forget(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    async def _execute(self, flight: Flight, run):
+        try:
+            flight.finish(result=await run(flight))
+        except (asyncio.CancelledError, Exception) as e:
+            flight.finish(error=e)
+        finally:
+            self._forget(flight)
+
+    async def do(self, key, fn):
+        """Awaits fn() (a coroutine function), sharing it with identical concurrent calls."""
+        flight = self.join(key, lambda _: fn())
+        try:
+            return await flight.wait()
+        finally:
+            self.leave(flight)
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class CallGroup:
+    """Blocking calls with the same key share one execution across threads."""
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            COALESCED.labels(operation=self.operation).inc()
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
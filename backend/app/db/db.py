@@ -1,25 +1,143 @@
+import asyncio
+import functools
+import logging
+import queue
 import sqlite3
+import threading
 import uuid
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from app.core.config import settings
+from app.core.log import get_logger, log_event
+from app.core.metrics import SQLITE_SECONDS, timed
+
+logger = get_logger("db")
 
 DB_PATH = "rag_app.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Applied to every pooled connection. WAL lets readers run alongside the
+# single writer; busy_timeout makes writers queue instead of failing.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={settings.DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA cache_size=-{settings.DB_CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size={settings.DB_MMAP_SIZE}",
+)
 
-def init_db():
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    # Enable Write-Ahead Logging for better concurrency
+class ConnectionPool:
+    """
+    Long-lived SQLite connections shared across threads. A connection is
+    used by one thread at a time: borrow it with `connection()` or
+    `transaction()` rather than calling acquire/release directly.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=settings.DB_BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            try:
+                conn.execute(pragma)
+            except sqlite3.Error as e:
+                log_event(logger, "pragma_failed", logging.WARNING, pragma=pragma, error=str(e))
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+db_pool = ConnectionPool(DB_PATH, settings.DB_POOL_SIZE)
+
+# Async handlers hand their queries to this executor so SQLite never blocks
+# the event loop; sized to the pool so queries rarely wait for a connection.
+_db_executor = None
+_db_executor_lock = threading.Lock()
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(max_workers=settings.DB_POOL_SIZE, thread_name_prefix="db")
+        return _db_executor
+
+@contextmanager
+def connection():
+    """Borrows a pooled connection for reads."""
+    conn = db_pool.acquire()
     try:
-        c.execute("PRAGMA journal_mode=WAL;")
-    except Exception as e:
-        print(f"Warning: Could not set WAL mode: {e}")
-    
+        yield conn
+    finally:
+        db_pool.release(conn)
+
+@contextmanager
+def transaction():
+    """Borrows a pooled connection; commits on success, rolls back on error."""
+    with connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+async def run_db(fn, *args, **kwargs):
+    """Runs a blocking database function on the database executor."""
+    loop = asyncio.get_running_loop()
+    # Includes time queued for a connection, which is what callers wait for
+    with timed(SQLITE_SECONDS, operation=getattr(fn, "__name__", "call")):
+        return await loop.run_in_executor(get_db_executor(), functools.partial(fn, *args, **kwargs))
+
+def close_db():
+    global _db_executor
+    with _db_executor_lock:
+        executor, _db_executor = _db_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+    db_pool.close()
+
+def ensure_column(c, table, column, definition):
+    """Adds a column to an existing table if an older schema lacks it."""
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in [row["name"] for row in c.fetchall()]:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def init_db():
+    # WAL and the other pragmas are applied by the pool
+    with transaction() as conn:
+        create_schema(conn.cursor())
+
+def create_schema(c):
     # Threads
     c.execute('''CREATE TABLE IF NOT EXISTS threads (
         id TEXT PRIMARY KEY,
@@ -37,6 +155,30 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY(thread_id) REFERENCES threads(id)
     )''')
+    # Sidebar and history pages are keyset scans over these
+    c.execute("CREATE INDEX IF NOT EXISTS idx_threads_updated_at ON threads(updated_at, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_thread_created ON messages(thread_id, created_at)")
+    
+    # Rolling summary of each thread's older turns (see app/core/memory.py).
+    # covered_rowid is the last message folded into the summary.
+    c.execute('''CREATE TABLE IF NOT EXISTS thread_summaries (
+        thread_id TEXT PRIMARY KEY,
+        summary TEXT,
+        covered_rowid INTEGER DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    
+    # Grader verdicts with the chunk's similarity to the question, for
+    # learning the automatic grading thresholds (see app/core/grading.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS grader_decisions (
+        id INTEGER PRIMARY KEY,
+        grader_model TEXT,
+        embedding_model TEXT,
+        similarity REAL,
+        relevant INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_grader_decisions_models ON grader_decisions(grader_model, embedding_model, id)")
     
     # Agents (Personas)
     c.execute('''CREATE TABLE IF NOT EXISTS agents (
@@ -45,15 +187,47 @@ def init_db():
         system_prompt TEXT,
         model TEXT,
         is_active INTEGER DEFAULT 0,
+        documents TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
+    ensure_column(c, "agents", "documents", "TEXT")  # JSON list of filenames the agent retrieves from; NULL for all
     
     # Documents
     c.execute('''CREATE TABLE IF NOT EXISTS documents (
         id TEXT PRIMARY KEY,
         filename TEXT,
+        file_hash TEXT,
+        chunk_count INTEGER,
+        centroid BLOB,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
+    ensure_column(c, "documents", "file_hash", "TEXT")
+    ensure_column(c, "documents", "chunk_count", "INTEGER")
+    ensure_column(c, "documents", "centroid", "BLOB")  # mean chunk embedding (float32), for the graph overview
+    c.execute("CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents(filename)")
+    
+    # Keyword index for hybrid retrieval. Chunk text lives in lexical_chunks;
+    # lexical_fts indexes it as an external-content FTS5 table kept in sync by
+    # triggers. `_` is a token character so identifiers like parse_config match whole.
+    c.execute('''CREATE TABLE IF NOT EXISTS lexical_chunks (
+        rowid INTEGER PRIMARY KEY,
+        chunk_id TEXT UNIQUE,
+        filename TEXT,
+        content TEXT
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_lexical_chunks_filename ON lexical_chunks(filename)")
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS lexical_fts USING fts5(
+        content,
+        content='lexical_chunks',
+        content_rowid='rowid',
+        tokenize="unicode61 tokenchars '_'"
+    )''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS lexical_chunks_ai AFTER INSERT ON lexical_chunks BEGIN
+        INSERT INTO lexical_fts(rowid, content) VALUES (new.rowid, new.content);
+    END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS lexical_chunks_ad AFTER DELETE ON lexical_chunks BEGIN
+        INSERT INTO lexical_fts(lexical_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+    END''')
     
     # Ensure default agent exists
     c.execute("SELECT count(*) FROM agents")
@@ -63,8 +237,5 @@ def init_db():
         c.execute("INSERT INTO agents (id, name, system_prompt, model, is_active) VALUES (?, ?, ?, ?, 1)",
                   (default_id, "Default (Grainy Brain)", default_prompt, settings.CHAT_MODEL))
 
-    conn.commit()
-    conn.close()
-
 # Initialize on module load? Or explicitly call.
 # Better to call from main.py startup event.
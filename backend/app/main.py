@@ -1,13 +1,61 @@
 
 
-from fastapi import FastAPI
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
-from app.api.v1 import chat, ingest, graph, agents, documents
+from app.api.v1 import chat, ingest, graph, agents, documents, cache
 
-from app.db.db import init_db
+from app.core.agent_registry import agent_registry
+from app.core.grading import grade_thresholds
+from app.core.jobs import ingest_jobs
+from app.core.log import configure_logging, get_logger, log_event
+from app.core.lexical import backfill_from_collection
+from app.core.ollama import ollama_clients
+from app.db.db import close_db, init_db
 
-app = FastAPI(title="Nurag API")
+logger = get_logger("main")
+
+def backfill_lexical_index():
+    try:
+        backfill_from_collection()
+    except Exception as e:
+        log_event(logger, "lexical_backfill_failed", logging.ERROR, exc_info=e)
+
+def warm_up_models():
+    """Loads the models the first chat would otherwise wait for."""
+    try:
+        active_model = agent_registry.resolve()["model"]
+    except Exception as e:
+        log_event(logger, "warm_up_agent_failed", logging.WARNING, error=str(e))
+        active_model = settings.CHAT_MODEL
+    ollama_clients.warm_up(
+        chat_models=[settings.ROUTER_MODEL, settings.GRADER_MODEL, active_model, settings.CHAT_MODEL],
+        embedding_models=[settings.EMBEDDING_MODEL],
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Index chunks stored before the keyword index existed, off the event loop
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, backfill_lexical_index)
+    if settings.OLLAMA_WARMUP:
+        loop.run_in_executor(None, warm_up_models)
+    if settings.GRADER_CALIBRATION:
+        # Thresholds learned in earlier runs
+        loop.run_in_executor(None, grade_thresholds.calibrate)
+    yield
+    # Stop background ingestion workers
+    ingest_jobs.shutdown()
+    close_db()
+    await ollama_clients.aclose()
+
+app = FastAPI(title="Nurag API", lifespan=lifespan)
+
+configure_logging()
 
 # Initialize DB
 init_db()
@@ -31,11 +79,17 @@ app.include_router(ingest.router, prefix=settings.API_V1_STR, tags=["ingest"])
 app.include_router(graph.router, prefix=settings.API_V1_STR, tags=["graph"])
 app.include_router(agents.router, prefix=settings.API_V1_STR, tags=["agents"])
 app.include_router(documents.router, prefix=settings.API_V1_STR, tags=["documents"])
+app.include_router(cache.router, prefix=settings.API_V1_STR, tags=["cache"])
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    """Latency histograms in Prometheus text format."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
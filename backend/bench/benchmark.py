@@ -0,0 +1,247 @@
+"""
+Offline benchmark: runs the app against a fake Ollama server and reports
+latency percentiles and throughput as JSON.
+
+Run from the backend directory:
+
+    python -m bench.benchmark --chats 200 --concurrency 16 --output bench.json
+
+The app's databases, uploads and Chroma store live in a temporary
+directory, so the run never touches local data. Chunking uses tiktoken,
+whose encoding must already be in the local tiktoken cache when running
+fully offline.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx
+import numpy as np
+import uvicorn
+
+from bench.fake_ollama import add_config_arguments, config_from_args, start_fake_ollama
+
+TOPICS = [
+    "vector databases", "container orchestration", "garbage collection", "query planning",
+    "consensus protocols", "page caches", "tokenizers", "service meshes",
+    "columnar storage", "rate limiting", "feature flags", "stream processing",
+]
+
+SMALLTALK = ["hello there", "thanks, that helps", "good morning", "how are you today?"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark against a fake Ollama server")
+    parser.add_argument("--documents", type=int, default=20, help="documents to ingest")
+    parser.add_argument("--sections", type=int, default=12, help="sections per document")
+    parser.add_argument("--chats", type=int, default=100, help="/chat requests")
+    parser.add_argument("--streams", type=int, default=50, help="/chat/stream requests")
+    parser.add_argument("--graph-requests", type=int, default=60, help="graph page requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight per workload")
+    parser.add_argument("--smalltalk-ratio", type=float, default=0.2, help="share of chats that are not questions")
+    parser.add_argument("--answer-cache", action="store_true", help="leave the answer cache on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    add_config_arguments(parser)
+    return parser.parse_args()
+
+def summarize(latencies: list, elapsed: float = None, errors: int = 0) -> dict:
+    """Latency percentiles (seconds) and, given the wall time, throughput for one workload."""
+    summary = {"requests": len(latencies), "errors": errors}
+    if elapsed is not None:
+        summary["elapsed_seconds"] = round(elapsed, 3)
+        summary["requests_per_sec"] = round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0
+    if latencies:
+        values = np.array(latencies)
+        for p in (50, 95, 99):
+            summary[f"p{p}"] = round(float(np.percentile(values, p)), 4)
+        summary["mean"] = round(float(values.mean()), 4)
+        summary["max"] = round(float(values.max()), 4)
+    return summary
+
+def synthetic_document(index: int, sections: int, rng: random.Random):
+    topic = TOPICS[index % len(TOPICS)]
+    lines = [f"# Notes on {topic} ({index})", ""]
+    for section in range(sections):
+        lines.append(f"## Section {section}")
+        for _ in range(6):
+            words = rng.sample(TOPICS, 3)
+            lines.append(
+                f"In {topic}, the interaction between {words[0]} and {words[1]} "
+                f"determines how {words[2]} behaves under load, case {rng.randint(0, 10_000)}."
+            )
+        lines.append("")
+    return f"bench_{index}_{topic.replace(' ', '_')}.md", "\n".join(lines)
+
+def chat_queries(count: int, smalltalk_ratio: float, rng: random.Random) -> list:
+    queries = []
+    for _ in range(count):
+        if rng.random() < smalltalk_ratio:
+            queries.append(rng.choice(SMALLTALK))
+        else:
+            a, b = rng.sample(TOPICS, 2)
+            queries.append(f"How does {a} interact with {b} in case {rng.randint(0, 10_000)}?")
+    return queries
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def run_concurrently(items, concurrency: int, fn):
+    """Runs fn over items with at most `concurrency` in flight; returns results and wall time."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(item):
+        async with semaphore:
+            return await fn(item)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(bounded(item) for item in items))
+    return results, time.perf_counter() - started
+
+async def wait_for_job(client: httpx.AsyncClient, job_id: str) -> dict:
+    while True:
+        job = (await client.get(f"/api/ingest/jobs/{job_id}")).json()
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            return job
+        await asyncio.sleep(0.05)
+
+async def ingest_workload(client, documents, concurrency: int) -> dict:
+    async def ingest(document):
+        filename, text = document
+        started = time.perf_counter()
+        response = await client.post("/api/ingest", files={"file": (filename, text.encode(), "text/markdown")})
+        if response.status_code != 202:
+            return None
+        job = await wait_for_job(client, response.json()["job_id"])
+        if job["status"] != "succeeded":
+            return None
+        return time.perf_counter() - started, job["chunks_total"]
+
+    results, elapsed = await run_concurrently(documents, concurrency, ingest)
+    done = [r for r in results if r is not None]
+    summary = summarize([r[0] for r in done], elapsed, errors=len(results) - len(done))
+    chunks = sum(r[1] for r in done)
+    summary["chunks"] = chunks
+    summary["chunks_per_sec"] = round(chunks / elapsed, 2) if elapsed > 0 else 0.0
+    return summary
+
+async def chat_workload(client, queries, concurrency: int) -> dict:
+    async def chat(query):
+        started = time.perf_counter()
+        response = await client.post("/api/chat", json={"query": query})
+        return time.perf_counter() - started if response.status_code == 200 else None
+
+    results, elapsed = await run_concurrently(queries, concurrency, chat)
+    latencies = [r for r in results if r is not None]
+    return summarize(latencies, elapsed, errors=len(results) - len(latencies))
+
+async def stream_workload(client, queries, concurrency: int) -> dict:
+    async def stream(query):
+        started, first_token = time.perf_counter(), None
+        async with client.stream("POST", "/api/chat/stream", json={"query": query}) as response:
+            if response.status_code != 200:
+                return None
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                    if event == "token" and first_token is None:
+                        first_token = time.perf_counter() - started
+                    elif event == "error":
+                        return None
+        return time.perf_counter() - started, first_token
+
+    results, elapsed = await run_concurrently(queries, concurrency, stream)
+    done = [r for r in results if r is not None]
+    summary = summarize([r[0] for r in done], elapsed, errors=len(results) - len(done))
+    first_tokens = [r[1] for r in done if r[1] is not None]
+    summary["first_token"] = summarize(first_tokens)
+    return summary
+
+async def graph_workload(client, filenames, count: int, concurrency: int) -> dict:
+    paths = ["/api/graph?level=documents", "/api/graph?level=chunks"]
+    paths += [f"/api/graph/documents/{name}" for name in filenames]
+    requests = [paths[i % len(paths)] for i in range(count)]
+
+    async def fetch(path):
+        started = time.perf_counter()
+        response = await client.get(path)
+        return time.perf_counter() - started if response.status_code == 200 else None
+
+    results, elapsed = await run_concurrently(requests, concurrency, fetch)
+    latencies = [r for r in results if r is not None]
+    return summarize(latencies, elapsed, errors=len(results) - len(latencies))
+
+async def run_workloads(base_url: str, args) -> dict:
+    rng = random.Random(args.seed)
+    documents = [synthetic_document(i, args.sections, rng) for i in range(args.documents)]
+    timeout = httpx.Timeout(600.0)
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        report = {"ingest": await ingest_workload(client, documents, args.concurrency)}
+        report["chat"] = await chat_workload(client, chat_queries(args.chats, args.smalltalk_ratio, rng), args.concurrency)
+        report["chat_stream"] = await stream_workload(client, chat_queries(args.streams, args.smalltalk_ratio, rng), args.concurrency)
+        report["graph"] = await graph_workload(client, [name for name, _ in documents], args.graph_requests, args.concurrency)
+    return report
+
+def start_app(port: int):
+    # Imported only now: settings are read from the environment at import time
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="bench-app", daemon=True)
+    thread.start()
+    deadline = time.time() + 60
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("App did not start within 60s")
+        time.sleep(0.05)
+    return server, thread
+
+def main():
+    args = parse_args()
+    output_path = os.path.abspath(args.output) if args.output else None
+    fake = start_fake_ollama(config_from_args(args))
+    os.environ["OLLAMA_BASE_URL"] = fake.base_url
+    os.environ["LOG_LEVEL"] = "WARNING"
+    if not args.answer_cache:
+        os.environ["ANSWER_CACHE_ENABLED"] = "false"
+
+    workdir = tempfile.mkdtemp(prefix="nurag_bench_")
+    os.chdir(workdir)
+    # The app prints progress; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        server, thread = start_app(free_port())
+        try:
+            report = asyncio.run(run_workloads(f"http://127.0.0.1:{server.config.port}", args))
+        finally:
+            server.should_exit = True
+            thread.join(timeout=30)
+    os.chdir(BACKEND_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    report["config"] = {k: v for k, v in vars(args).items() if k != "output"}
+    report["ollama"] = dict(fake.stats)
+    fake.shutdown()
+    output = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Stand-in for the Ollama HTTP API, for benchmarks and UI work without models.
+
+Implements the endpoints the backend calls (/api/chat, /api/generate,
+/api/embeddings, /api/embed, /api/tags) with synthetic output and a
+simple cost model: prompt processing at --prefill-rate tokens/sec, then
+--token-rate generated tokens/sec, with at most --parallel generations at
+once (like OLLAMA_NUM_PARALLEL). Embeddings are deterministic hashed
+bag-of-words vectors, so retrieval still finds related chunks.
+
+    python -m bench.fake_ollama --port 11434
+"""
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+@dataclass
+class FakeOllamaConfig:
+    token_rate: float = 50.0  # generated tokens per second, per request
+    prefill_rate: float = 2000.0  # prompt tokens processed per second
+    first_token_latency: float = 0.02  # fixed overhead before the first token
+    response_tokens: int = 40
+    parallel: int = 4  # concurrent generations; the rest queue
+    embed_dim: int = 768
+    embed_latency: float = 0.005  # per embedded text
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def embed(text: str, dim: int) -> list:
+    vector = [0.0] * dim
+    for word in re.findall(r"\w+", text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dim] += 1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def json_answer(prompt: str) -> str:
+    """Structured output for the router and grader prompts."""
+    if "datasource" in prompt:
+        return json.dumps({"datasource": "vectorstore"})
+    if "'scores'" in prompt:
+        return json.dumps({"scores": ["yes"] * prompt.count("[Document ")})
+    return json.dumps({"binary_score": "yes"})
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: FakeOllamaConfig):
+        super().__init__(address, FakeOllamaHandler)
+        self.config = config
+        self.slots = threading.Semaphore(config.parallel)
+        self.stats_lock = threading.Lock()
+        self.stats = {"chat_requests": 0, "embed_requests": 0, "embed_texts": 0, "prompt_tokens": 0, "generated_tokens": 0}
+
+    def count(self, **increments):
+        with self.stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeOllamaServer
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, obj, status: int = 200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, obj):
+        line = (json.dumps(obj) + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            return self.send_json({"models": [{"name": "gemma3:latest"}, {"name": "gemma3:1b"}]})
+        self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.config
+
+        if self.path in ("/api/embeddings", "/api/embed"):
+            texts = body.get("input", body.get("prompt", ""))
+            texts = [texts] if isinstance(texts, str) else texts
+            time.sleep(config.embed_latency * len(texts))
+            self.server.count(embed_requests=1, embed_texts=len(texts))
+            vectors = [embed(t, config.embed_dim) for t in texts]
+            if self.path == "/api/embed":
+                return self.send_json({"model": body.get("model"), "embeddings": vectors})
+            return self.send_json({"embedding": vectors[0]})
+
+        if self.path not in ("/api/chat", "/api/generate"):
+            return self.send_json({"error": "not found"}, 404)
+
+        messages = body.get("messages") or []
+        prompt = "\n".join(m.get("content", "") for m in messages) if messages else body.get("prompt") or ""
+        if not prompt:
+            # A request without a prompt just loads the model
+            return self.send_json({"model": body.get("model"), "response": "", "done": True})
+        self.generate(body, prompt)
+
+    def generate(self, body: dict, prompt: str):
+        config = self.server.config
+        prompt_tokens = estimate_tokens(prompt)
+        if body.get("format") == "json":
+            tokens = re.findall(r"\S+\s*", json_answer(prompt))
+        else:
+            tokens = [f"token{i} " for i in range(config.response_tokens)]
+
+        with self.server.slots:
+            time.sleep(config.first_token_latency + prompt_tokens / config.prefill_rate)
+            self.server.count(chat_requests=1, prompt_tokens=prompt_tokens, generated_tokens=len(tokens))
+            chat = self.path == "/api/chat"
+
+            def frame(token: str, done: bool) -> dict:
+                frame = {"model": body.get("model"), "done": done}
+                if chat:
+                    frame["message"] = {"role": "assistant", "content": token}
+                else:
+                    frame["response"] = token
+                return frame
+
+            if not body.get("stream", True):
+                time.sleep(len(tokens) / config.token_rate)
+                return self.send_json(frame("".join(tokens), True))
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                self.send_chunk(frame(token, False))
+                time.sleep(1 / config.token_rate)
+            self.send_chunk(frame("", True))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+def start_fake_ollama(config: FakeOllamaConfig, host: str = "127.0.0.1", port: int = 0) -> FakeOllamaServer:
+    """Starts the server on a background thread; port 0 picks a free port."""
+    server = FakeOllamaServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    defaults = FakeOllamaConfig()
+    parser.add_argument("--token-rate", type=float, default=defaults.token_rate, help="generated tokens/sec per request")
+    parser.add_argument("--prefill-rate", type=float, default=defaults.prefill_rate, help="prompt tokens/sec")
+    parser.add_argument("--first-token-latency", type=float, default=defaults.first_token_latency, help="seconds before the first token")
+    parser.add_argument("--response-tokens", type=int, default=defaults.response_tokens)
+    parser.add_argument("--parallel", type=int, default=defaults.parallel, help="concurrent generations")
+    parser.add_argument("--embed-dim", type=int, default=defaults.embed_dim)
+    parser.add_argument("--embed-latency", type=float, default=defaults.embed_latency, help="seconds per embedded text")
+
+def config_from_args(args) -> FakeOllamaConfig:
+    return FakeOllamaConfig(
+        token_rate=args.token_rate,
+        prefill_rate=args.prefill_rate,
+        first_token_latency=args.first_token_latency,
+        response_tokens=args.response_tokens,
+        parallel=args.parallel,
+        embed_dim=args.embed_dim,
+        embed_latency=args.embed_latency,
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = FakeOllamaServer((args.host, args.port), config_from_args(args))
+    print(f"Fake Ollama listening on {server.base_url}")
+    server.serve_forever()
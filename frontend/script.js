@@ -2,6 +2,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- State ---
     let currentThreadId = null;
     let currentAgentId = null;
+    const focusedDocs = new Set(); // documents chat retrieval is restricted to; empty = all
     
     // --- Elements ---
     const messagesContainer = document.getElementById('messages-container');
@@ -28,10 +29,14 @@ document.addEventListener('DOMContentLoaded', () => {
         .nodeColor(() => '#FF4F00') // All nodes Orange
         .nodeRelSize(3) // Smaller, consistent size
         .linkColor(() => '#333333') // Dark Grey Links
-        .linkWidth(1)
+        .linkWidth(link => link.value ? 0.5 + link.value : 1) // Stronger similarity, thicker link
         .onNodeClick(node => {
             Graph.centerAt(node.x, node.y, 1000);
             Graph.zoom(8, 2000);
+            // Document nodes expand into their chunks, one page per click
+            if (node.type === 'document' && node.expandCursor !== null) {
+                expandDocument(node);
+            }
         });
 
     // Custom Node Canvas Object for "Square / Wireframe" look
@@ -47,15 +52,55 @@ document.addEventListener('DOMContentLoaded', () => {
         ctx.stroke();
     });
 
+    // Level-of-detail graph: document nodes first, chunks added on expand.
+    // Links can arrive before both of their nodes, so they are kept aside
+    // and only drawn once both ends are loaded.
+    let graphNodes = new Map();
+    let graphLinks = new Map();
+
+    function mergeGraphPage(data) {
+        const existing = new Map(Graph.graphData().nodes.map(n => [n.id, n]));
+        data.nodes.forEach(n => graphNodes.set(n.id, Object.assign(existing.get(n.id) || {}, graphNodes.get(n.id) || {}, n)));
+        data.links.forEach(l => {
+            const key = [l.source, l.target].sort().join('|');
+            if (!graphLinks.has(key)) graphLinks.set(key, l);
+        });
+        const links = [...graphLinks.values()]
+            .filter(l => graphNodes.has(l.source) && graphNodes.has(l.target))
+            .map(l => ({ ...l }));
+        Graph.graphData({ nodes: [...graphNodes.values()], links });
+    }
+
     async function loadGraphData() {
+        graphNodes = new Map();
+        graphLinks = new Map();
+        Graph.graphData({ nodes: [], links: [] });
         try {
-            const res = await fetch('/api/graph');
-            const data = await res.json();
-            Graph.graphData(data);
+            let cursor = null;
+            do {
+                const url = '/api/graph?level=documents' + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : '');
+                const res = await fetch(url);
+                const data = await res.json();
+                mergeGraphPage(data);
+                cursor = data.next_cursor;
+            } while (cursor);
         } catch (err) {
             console.error("Graph load error:", err);
         }
     }
+
+    async function expandDocument(node) {
+        try {
+            let url = `/api/graph/documents/${encodeURIComponent(node.name)}`;
+            if (node.expandCursor) url += `?cursor=${encodeURIComponent(node.expandCursor)}`;
+            const res = await fetch(url);
+            const data = await res.json();
+            node.expandCursor = data.next_cursor;
+            mergeGraphPage(data);
+        } catch (err) {
+            console.error("Graph expand error:", err);
+        }
+    }
     loadGraphData();
     window.addEventListener('resize', () => { Graph.width(window.innerWidth); Graph.height(window.innerHeight); });
 
@@ -84,14 +129,20 @@ document.addEventListener('DOMContentLoaded', () => {
     tabBtnMemory.addEventListener('click', () => switchTab('memory'));
 
     // --- HISTORY SIDEBAR (With Delete) ---
-    async function loadHistory() {
+    const HISTORY_PAGE_SIZE = 50;
+
+    // Pages through threads by keyset: `before` is the last thread already shown
+    async function loadHistory(before = null) {
         try {
-            const res = await fetch('/api/threads');
+            let url = `/api/threads?limit=${HISTORY_PAGE_SIZE}`;
+            if (before) url += `&before=${encodeURIComponent(before)}`;
+            const res = await fetch(url);
             const threads = await res.json();
             
-            historyList.innerHTML = '';
+            if (!before) historyList.innerHTML = '';
+            historyList.querySelector('.load-more')?.remove();
             
-            if (threads.length === 0) {
+            if (!before && threads.length === 0) {
                 historyList.innerHTML = '<div class="empty-state">No Active Threads</div>';
                 return;
             }
@@ -125,6 +176,14 @@ document.addEventListener('DOMContentLoaded', () => {
                 
                 historyList.appendChild(div);
             });
+            
+            if (threads.length === HISTORY_PAGE_SIZE) {
+                const more = document.createElement('div');
+                more.className = 'history-item load-more';
+                more.textContent = 'Load more...';
+                more.addEventListener('click', () => loadHistory(threads[threads.length - 1].id));
+                historyList.appendChild(more);
+            }
         } catch (err) {
             console.error("History error:", err);
             historyList.innerHTML = '<div class="empty-state">Connection Error</div>';
@@ -145,6 +204,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const promptInput = document.getElementById('agent-prompt-input');
     
     let editingAgentId = null; // null = creating new
+    let editingAgentDocs = null; // document scope of the agent being edited, kept as is on save
     
     function toggleAgentEditor(show) {
         if (show) {
@@ -238,6 +298,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const agent = await getAgentDetails(currentAgentId);
         if (agent) {
             editingAgentId = agent.id;
+            editingAgentDocs = agent.documents ?? null;
             nameInput.value = agent.name;
             promptInput.value = agent.system_prompt;
             
@@ -253,6 +314,7 @@ document.addEventListener('DOMContentLoaded', () => {
     
     createAgentBtn.addEventListener('click', () => {
         editingAgentId = null; // New
+        editingAgentDocs = null;
         nameInput.value = '';
         promptInput.value = 'You are an AI assistant...';
         // Default first model
@@ -270,7 +332,8 @@ document.addEventListener('DOMContentLoaded', () => {
         const payload = {
             name: nameInput.value,
             model: modelSelect.value,
-            system_prompt: promptInput.value
+            system_prompt: promptInput.value,
+            documents: editingAgentDocs
         };
         
         try {
@@ -345,6 +408,10 @@ document.addEventListener('DOMContentLoaded', () => {
             // Stats Update
             document.getElementById('stat-nodes').textContent = docs.length.toString().padStart(3, '0');
             
+            // Forget focus on documents that are gone
+            const filenames = new Set(docs.map(doc => doc.filename));
+            [...focusedDocs].forEach(name => { if (!filenames.has(name)) focusedDocs.delete(name); });
+            
             docsList.innerHTML = '';
             if (docs.length === 0) {
                  docsList.innerHTML = '<div class="empty-state">Memory Banks Empty</div>';
@@ -352,12 +419,20 @@ document.addEventListener('DOMContentLoaded', () => {
                 docs.forEach(doc => {
                      const div = document.createElement('div');
                     div.className = 'memory-card';
+                    div.classList.toggle('focused', focusedDocs.has(doc.filename));
                     div.innerHTML = `
                         <div class="mem-icon">📄</div>
                         <div class="mem-name" title="${doc.filename}">${doc.filename}</div>
                         <div class="mem-delete" title="Purge Engram">×</div>
                     `;
                     
+                    // Click to focus chat retrieval on this document (several can be focused)
+                    div.addEventListener('click', () => {
+                        if (focusedDocs.has(doc.filename)) focusedDocs.delete(doc.filename);
+                        else focusedDocs.add(doc.filename);
+                        div.classList.toggle('focused', focusedDocs.has(doc.filename));
+                    });
+                    
                     div.querySelector('.mem-delete').addEventListener('click', async (e) => {
                         e.stopPropagation();
                         if (confirm(`Delete ${doc.filename}?`)) {
@@ -405,36 +480,90 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Polls a background ingestion job until it finishes
+    async function waitForIngestJob(jobId) {
+        while (true) {
+            const res = await fetch(`/api/ingest/jobs/${jobId}`);
+            const job = await res.json();
+            if (!['queued', 'running'].includes(job.status)) return job;
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+
     async function handleFiles(files) {
         if (!files.length) return;
+        files = Array.from(files);
         
-        // Process each file individually
-        for (const file of Array.from(files)) {
-            const formData = new FormData();
-            formData.append('file', file); // Singular 'file' matches backend
-
-            addMessageToUI('system', `Ingesting packet: ${file.name}...`);
-            try {
-                const res = await fetch('/api/ingest', {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                if (!res.ok) {
-                    const err = await res.text();
-                    throw new Error(err);
-                }
-
-                const data = await res.json();
-                addMessageToUI('system', `Ingestion Complete. Processed ${data.chunks} chunks.`);
-            } catch (err) {
-                addMessageToUI('system', `Ingestion Failed for ${file.name}: ${err.message}`);
-            }
+        const isArchive = name => /\.(zip|tar|tgz|tar\.gz|tar\.bz2|tbz2|tar\.xz|txz)$/i.test(name);
+        if (files.length > 1 || isArchive(files[0].name)) {
+            await ingestBulk(files);
+        } else {
+            await ingestSingle(files[0]);
         }
         
         loadDocs();
         loadGraphData();
     }
+
+    async function ingestSingle(file) {
+        const formData = new FormData();
+        formData.append('file', file); // Singular 'file' matches backend
+
+        addMessageToUI('system', `Ingesting packet: ${file.name}...`);
+        try {
+            const res = await fetch('/api/ingest', {
+                method: 'POST',
+                body: formData
+            });
+            
+            if (!res.ok) {
+                const err = await res.text();
+                throw new Error(err);
+            }
+
+            const data = await res.json();
+            const job = await waitForIngestJob(data.job_id);
+            if (job.status !== 'succeeded') {
+                throw new Error(job.error || `Job ${job.status}`);
+            }
+            const r = job.result;
+            addMessageToUI('system', r.status === 'unchanged'
+                ? `Ingestion Skipped. ${file.name} is unchanged.`
+                : `Ingestion Complete. ${r.chunks} chunks (${r.added} new, ${r.removed} removed).`);
+        } catch (err) {
+            addMessageToUI('system', `Ingestion Failed for ${file.name}: ${err.message}`);
+        }
+    }
+
+    async function ingestBulk(files) {
+        const formData = new FormData();
+        files.forEach(file => formData.append('files', file));
+
+        addMessageToUI('system', `Ingesting ${files.length} packet(s) in bulk...`);
+        try {
+            const res = await fetch('/api/ingest/bulk', {
+                method: 'POST',
+                body: formData
+            });
+            
+            if (!res.ok) {
+                const err = await res.text();
+                throw new Error(err);
+            }
+
+            const data = await res.json();
+            const job = await waitForIngestJob(data.job_id);
+            if (job.status !== 'succeeded') {
+                throw new Error(job.error || `Job ${job.status}`);
+            }
+            const counts = {};
+            job.result.files.forEach(f => { counts[f.status] = (counts[f.status] || 0) + 1; });
+            const summary = Object.entries(counts).map(([status, n]) => `${n} ${status}`).join(', ');
+            addMessageToUI('system', `Bulk Ingestion Complete. ${summary}.`);
+        } catch (err) {
+            addMessageToUI('system', `Bulk Ingestion Failed: ${err.message}`);
+        }
+    }
     
     // Call setup
     setupDragAndDrop();
@@ -484,6 +613,30 @@ document.addEventListener('DOMContentLoaded', () => {
         terminalInterface.scrollTop = terminalInterface.scrollHeight;
     }
 
+    // Parses a text/event-stream response body, calling onEvent(event, data) per frame
+    async function readEventStream(res, onEvent) {
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, sep);
+                buffer = buffer.slice(sep + 2);
+                let event = 'message';
+                let data = '';
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                });
+                onEvent(event, data ? JSON.parse(data) : {});
+            }
+        }
+    }
+
     async function sendMessage() {
         const query = chatInput.value.trim();
         if (!query) return;
@@ -508,27 +661,55 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             const payload = { query };
             if (currentThreadId) payload.thread_id = currentThreadId;
+            // Answer with the persona shown in this tab, whatever other clients select
+            if (currentAgentId) payload.agent_id = currentAgentId;
+            if (focusedDocs.size > 0) payload.filenames = [...focusedDocs];
             
-            const res = await fetch('/api/chat', {
+            const res = await fetch('/api/chat/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify(payload)
             });
-            const data = await res.json();
-            
-            // Set current thread if new
-            if (data.thread_id && currentThreadId !== data.thread_id) {
-                currentThreadId = data.thread_id;
-                loadHistory(); // Refresh sidebar to show new thread
-            }
-            
-            // Remove loader
-            loaderDiv.remove();
-            
-            addMessageToUI('assistant', data.response);
+            if (!res.ok) throw new Error(await res.text());
+
+            const loaderText = loaderDiv.querySelector('.content');
+            let answerDiv = null;
+            let answer = '';
+
+            await readEventStream(res, (event, data) => {
+                if (event === 'thread') {
+                    if (data.thread_id && currentThreadId !== data.thread_id) {
+                        currentThreadId = data.thread_id;
+                        loadHistory(); // Refresh sidebar to show new thread
+                    }
+                } else if (event === 'routed') {
+                    loaderText.textContent = data.route === 'retrieve' ? 'Querying memory core...' : 'Composing response...';
+                } else if (event === 'retrieved') {
+                    loaderText.textContent = `Retrieved ${data.count} fragments. Grading...`;
+                } else if (event === 'graded') {
+                    loaderText.textContent = `${data.count} relevant fragments. Composing response...`;
+                } else if (event === 'token') {
+                    if (!answerDiv) {
+                        loaderDiv.remove();
+                        addMessageToUI('assistant', '');
+                        answerDiv = messagesContainer.lastElementChild.querySelector('.content');
+                    }
+                    answer += data.content;
+                    answerDiv.textContent = answer;
+                    terminalInterface.scrollTop = terminalInterface.scrollHeight;
+                } else if (event === 'done') {
+                    loaderDiv.remove();
+                    if (answerDiv) answerDiv.parentElement.remove();
+                    addMessageToUI('assistant', data.response);
+                } else if (event === 'error') {
+                    const error = new Error(data.detail);
+                    error.busy = data.status === 429;
+                    throw error;
+                }
+            });
         } catch (err) {
             loaderDiv.remove();
-            addMessageToUI('assistant', "Error: Connection lost.");
+            addMessageToUI('assistant', err.busy ? "Error: Models are busy, try again shortly." : "Error: Connection lost.");
         } finally {
             // Re-enable UI
             sendBtn.disabled = false;